@@ -0,0 +1,106 @@
+import { afterEach, beforeEach, describe, expect, it } from 'vitest';
+import { decodeEmbedding, resolveBackend, VisionBridge } from '../src/vision/bridge.mjs';
+
+describe('resolveBackend', () => {
+  let savedBackend;
+
+  beforeEach(() => {
+    savedBackend = process.env.VISION_BACKEND;
+    delete process.env.VISION_BACKEND;
+  });
+
+  afterEach(() => {
+    if (savedBackend === undefined) delete process.env.VISION_BACKEND;
+    else process.env.VISION_BACKEND = savedBackend;
+  });
+
+  it('prefers an explicit backend', () => {
+    process.env.VISION_BACKEND = 'mlx';
+    expect(resolveBackend('torch')).toBe('torch');
+  });
+
+  it('uses VISION_BACKEND when no backend is passed', () => {
+    process.env.VISION_BACKEND = 'mlx';
+    expect(resolveBackend(undefined, { platform: 'linux', arch: 'x64' })).toBe('mlx');
+  });
+
+  it('defaults to torch off Apple Silicon', () => {
+    expect(resolveBackend(undefined, { platform: 'linux', arch: 'x64' })).toBe('torch');
+    expect(resolveBackend(undefined, { platform: 'darwin', arch: 'x64' })).toBe('torch');
+  });
+});
+
+describe('decodeEmbedding', () => {
+  const b64 = (typed) => Buffer.from(typed.buffer).toString('base64');
+
+  it('decodes nested arrays', () => {
+    const vecs = decodeEmbedding([
+      [1, 0],
+      [0.5, -0.5],
+    ]);
+    expect(vecs).toHaveLength(2);
+    expect(vecs[1]).toBeInstanceOf(Float32Array);
+    expect(Array.from(vecs[1])).toEqual([0.5, -0.5]);
+  });
+
+  it('rescales int8 codes by per-vector float16 scales', () => {
+    const codes = new Int8Array([127, -64, 10, 0]);
+    const scales = new Uint16Array([0x3c00, 0x3800]); // 1.0, 0.5
+    const vecs = decodeEmbedding({ dtype: 'int8', shape: [2, 2], data: b64(codes), scales: b64(scales) });
+    expect(Array.from(vecs[0])).toEqual([127, -64]);
+    expect(Array.from(vecs[1])).toEqual([5, 0]);
+  });
+
+  it('widens float16 payloads to float32', () => {
+    const halves = new Uint16Array([0x3c00, 0xc000, 0x3555, 0x0000]); // 1, -2, ~0.3333, 0
+    const vecs = decodeEmbedding({ dtype: 'float16', shape: [2, 2], data: b64(halves) });
+    expect(vecs[0][0]).toBe(1);
+    expect(vecs[0][1]).toBe(-2);
+    expect(vecs[1][0]).toBeCloseTo(1 / 3, 3);
+    expect(vecs[1][1]).toBe(0);
+  });
+
+  it('returns vectors usable as SQLite blobs', () => {
+    const vecs = decodeEmbedding({ dtype: 'float32', shape: [2, 2], data: b64(new Float32Array([1, 2, 3, 4])) });
+    const blob = Buffer.from(vecs[1].buffer, vecs[1].byteOffset, vecs[1].byteLength);
+    expect(Array.from(new Float32Array(blob.buffer.slice(blob.byteOffset, blob.byteOffset + 8)))).toEqual([3, 4]);
+  });
+
+  it('rejects unknown dtypes', () => {
+    expect(() => decodeEmbedding({ dtype: 'bfloat16', shape: [1, 1], data: '' })).toThrow(/Unsupported/);
+  });
+});
+
+describe('VisionBridge streaming', () => {
+  function connectedBridge() {
+    const bridge = new VisionBridge({ backend: 'torch' });
+    const sent = [];
+    bridge.ready = true;
+    bridge.process = { stdin: { write: (line) => sent.push(JSON.parse(line)) } };
+    return { bridge, sent };
+  }
+
+  it('delivers partial pages before resolving with the final result', async () => {
+    const { bridge, sent } = connectedBridge();
+    const pages = [];
+    const done = bridge.embedImagesStream(['a.png', 'b.png'], (page) => pages.push(page));
+
+    const { id, method } = sent[0];
+    expect(method).toBe('embed_images_stream');
+    bridge._handleResponse(JSON.stringify({ id, partial: { index: 1, embedding: [[0.5, 0.5]], num_vectors: 1 } }));
+    bridge._handleResponse(JSON.stringify({ id, partial: { index: 0, embedding: [[1, 0]], num_vectors: 1 } }));
+    expect(pages.map((page) => page.index)).toEqual([1, 0]);
+    expect(pages[0].embedding[0]).toBeInstanceOf(Float32Array);
+
+    bridge._handleResponse(JSON.stringify({ id, result: { num_vectors: [1, 1] } }));
+    await expect(done).resolves.toEqual({ num_vectors: [1, 1] });
+    expect(bridge.pending.size).toBe(0);
+  });
+
+  it('rejects a stream that ends in an error', async () => {
+    const { bridge, sent } = connectedBridge();
+    const done = bridge.embedImagesStream(['a.png'], () => {});
+    bridge._handleResponse(JSON.stringify({ id: sent[0].id, error: 'boom' }));
+    await expect(done).rejects.toThrow('boom');
+  });
+});
@@ -0,0 +1,58 @@
+/**
+ * Wire encodings of the vision servers: every VISION_EMBEDDING_ENCODING is
+ * serialized by src/vision/common.py and decoded by the bridge.
+ *
+ * Requires a Python venv from setup.sh or setup-mlx.sh (skipped otherwise).
+ */
+
+import { execFileSync } from 'child_process';
+import { existsSync } from 'fs';
+import { dirname, join } from 'path';
+import { fileURLToPath } from 'url';
+import { describe, expect, it } from 'vitest';
+import { decodeEmbedding } from '../src/vision/bridge.mjs';
+
+const __dirname = dirname(fileURLToPath(import.meta.url));
+const visionDir = join(dirname(__dirname), 'src', 'vision');
+const python = ['venv-mlx', 'venv'].map((venv) => join(visionDir, venv, 'bin', 'python3')).find(existsSync);
+
+const EXPECTED = [
+  [1, -0.5],
+  [0.25, 0],
+];
+
+// Writes one {"encoding", "dtype", "page", "query"} line per encoding and source dtype
+const SCRIPT = `
+import numpy as np
+import common
+
+for dtype in (np.float16, np.float32):
+    vecs = np.array(${JSON.stringify(EXPECTED)}, dtype=dtype)
+    for encoding in ("float16", "int8", "json"):
+        common.write_message({
+            "encoding": encoding,
+            "dtype": np.dtype(dtype).name,
+            "page": common.encode_page(vecs, encoding),
+            "query": common.encode_query(vecs, encoding),
+        })
+`;
+
+describe.skipIf(!python)('vision embedding encodings', () => {
+  it('serializes every encoding from float16 and float32 arrays', () => {
+    const output = execFileSync(python, ['-c', SCRIPT], { cwd: visionDir, encoding: 'utf8' });
+    const lines = output.trim().split('\n').map((line) => JSON.parse(line));
+    expect(lines).toHaveLength(6);
+
+    for (const { encoding, dtype, page, query } of lines) {
+      for (const vecs of [decodeEmbedding(page), decodeEmbedding(query)]) {
+        expect(vecs, `${encoding} from ${dtype}`).toHaveLength(2);
+        vecs.forEach((vec, i) => {
+          expect(vec).toBeInstanceOf(Float32Array);
+          vec.forEach((value, j) => expect(value).toBeCloseTo(EXPECTED[i][j], 2));
+        });
+      }
+      if (encoding === 'int8') expect(page.dtype).toBe('int8');
+      if (encoding === 'json') expect(Array.isArray(page)).toBe(true);
+    }
+  });
+});
@@ -0,0 +1,100 @@
+/**
+ * Parity of src/vision/preproc.py (the MLX server's image preprocessing)
+ * with transformers' Qwen2VLImageProcessor at the ColPali pixel budget.
+ *
+ * Requires a Python venv from setup.sh or setup-mlx.sh (skipped otherwise).
+ */
+
+import { execFileSync } from 'child_process';
+import { existsSync } from 'fs';
+import { dirname, join } from 'path';
+import { fileURLToPath } from 'url';
+import { beforeAll, describe, expect, it } from 'vitest';
+
+const __dirname = dirname(fileURLToPath(import.meta.url));
+const visionDir = join(dirname(__dirname), 'src', 'vision');
+const python = ['venv-mlx', 'venv'].map((venv) => join(visionDir, venv, 'bin', 'python3')).find(existsSync);
+
+// Small JPEGs only: larger ones decode through draft() and differ by design
+const CASES = [
+  { name: 'odd', size: [333, 517], mode: 'RGB', ext: 'png' },
+  { name: 'wide', size: [1999, 61], mode: 'RGB', ext: 'png' },
+  { name: 'tiny', size: [20, 30], mode: 'RGB', ext: 'png' },
+  { name: 'large', size: [2480, 3508], mode: 'RGB', ext: 'png' },
+  { name: 'rgba', size: [401, 299], mode: 'RGBA', ext: 'png' },
+  { name: 'gray', size: [250, 180], mode: 'L', ext: 'png' },
+  { name: 'jpeg', size: [640, 480], mode: 'RGB', ext: 'jpg' },
+];
+
+// Writes one {"name", "source", "grid", "expected_grid", "shape", "expected_shape", "max_diff"}
+// line per case and preproc entry point, then {"aspect_guard": bool}
+const SCRIPT = `
+import json, os, tempfile
+import numpy as np
+from PIL import Image
+from transformers import Qwen2VLImageProcessor
+import preproc
+
+MIN_PIXELS, MAX_PIXELS = 3136, 602112
+reference = Qwen2VLImageProcessor(min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS)
+rng = np.random.default_rng(0)
+tmp = tempfile.mkdtemp()
+
+for case in json.loads(${JSON.stringify(JSON.stringify(CASES))}):
+    width, height = case["size"]
+    channels = len(case["mode"])
+    pixels = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+    path = os.path.join(tmp, case["name"] + "." + case["ext"])
+    Image.fromarray(pixels.squeeze(-1) if channels == 1 else pixels, case["mode"]).save(path)
+
+    expected = reference(images=[Image.open(path)], return_tensors="np")
+    expected_values = expected["pixel_values"]
+    expected_grid = expected["image_grid_thw"][0].tolist()
+    for source, (values, grid) in (
+        ("preprocess", preproc.preprocess(Image.open(path), MIN_PIXELS, MAX_PIXELS)),
+        ("load_and_preprocess", preproc.load_and_preprocess(path, MIN_PIXELS, MAX_PIXELS)),
+    ):
+        same_shape = values.shape == expected_values.shape
+        print(json.dumps({
+            "name": case["name"],
+            "source": source,
+            "grid": list(grid),
+            "expected_grid": expected_grid,
+            "shape": list(values.shape),
+            "expected_shape": list(expected_values.shape),
+            "max_diff": float(np.abs(values - expected_values).max()) if same_shape else None,
+        }))
+
+try:
+    preproc.smart_resize(10, 2010, MIN_PIXELS, MAX_PIXELS)
+    print(json.dumps({"aspect_guard": False}))
+except ValueError:
+    print(json.dumps({"aspect_guard": True}))
+`;
+
+describe.skipIf(!python)('vision image preprocessing', () => {
+  let lines;
+
+  beforeAll(() => {
+    const output = execFileSync(python, ['-c', SCRIPT], { cwd: visionDir, encoding: 'utf8' });
+    lines = output
+      .trim()
+      .split('\n')
+      .map((line) => JSON.parse(line));
+  }, 120000);
+
+  it('matches Qwen2VLImageProcessor on odd sizes, RGBA, grayscale and JPEG', () => {
+    const results = lines.filter((line) => line.name);
+    expect(results).toHaveLength(CASES.length * 2);
+    for (const { name, source, grid, expected_grid, shape, expected_shape, max_diff } of results) {
+      const label = `${name} via ${source}`;
+      expect(grid, label).toEqual(expected_grid);
+      expect(shape, label).toEqual(expected_shape);
+      expect(max_diff, label).toBeLessThan(1e-4);
+    }
+  });
+
+  it('rejects aspect ratios above 200 like the reference', () => {
+    expect(lines.find((line) => 'aspect_guard' in line)).toEqual({ aspect_guard: true });
+  });
+});
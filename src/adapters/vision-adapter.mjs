@@ -5,7 +5,7 @@
  * Each page image produces ~700 token vectors of 128 dimensions each.
  */
 
-import { VisionBridge } from '../vision/bridge.mjs';
+import { resolveBackend, VisionBridge } from '../vision/bridge.mjs';
 
 const MODEL_IDS = {
   torch: 'tsystems/colqwen2.5-3b-multilingual-v1.0-merged',
@@ -15,7 +15,7 @@ const EMBEDDING_DIM = 128; // ColBERT-style 128-dim per token vector
 
 export function createVisionAdapter({ backend } = {}) {
   let bridge = null;
-  const resolvedBackend = backend || process.env.VISION_BACKEND || 'torch';
+  const resolvedBackend = resolveBackend(backend);
 
   return {
     name: 'colqwen25-vision',
@@ -48,6 +48,14 @@ export function createVisionAdapter({ backend } = {}) {
       return result.embeddings;
     },
 
+    /**
+     * Embed page images, calling onPage({ index, embedding, num_vectors }) as
+     * each page finishes. Resolves to { num_vectors } when all pages are done.
+     */
+    async embedImagesStream(imagePaths, onPage) {
+      return bridge.embedImagesStream(imagePaths, onPage);
+    },
+
     /**
      * Extract page images from a PDF.
      */
@@ -55,6 +63,13 @@ export function createVisionAdapter({ backend } = {}) {
       return bridge.extractPages(pdfPath, outputDir);
     },
 
+    /**
+     * Rasterize and embed all pages of a PDF in memory (PNGs only if outputDir is set).
+     */
+    async extractAndEmbed(pdfPath, outputDir) {
+      return bridge.extractAndEmbed(pdfPath, outputDir);
+    },
+
     /**
      * Extract text from PDF pages (PyMuPDF + optional pytesseract OCR fallback).
      */
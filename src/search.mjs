@@ -268,6 +268,14 @@ export async function search(query, indexNames, opts = {}) {
           continue;
         }
 
+        // Vectors from different ColQwen checkpoints are not comparable
+        const indexModelId = getMeta(db, 'vision_model_id');
+        if (indexModelId && indexModelId !== visionAdapter.modelId()) {
+          console.error(
+            `Warning: Index "${name}" was built with ${indexModelId} but queries use ${visionAdapter.modelId()}; set VISION_BACKEND to match.`,
+          );
+        }
+
         const maxSimResults = searchVisionIndex(db, queryVectors, topK * 2);
         const sourcePath = getMeta(db, 'source_path');
 
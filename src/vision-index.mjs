@@ -12,7 +12,7 @@ import { mkdirSync, readFileSync } from 'fs';
 import { homedir } from 'os';
 import { join } from 'path';
 import { createVisionAdapter } from './adapters/vision-adapter.mjs';
-import { openDb, setMeta } from './schema.mjs';
+import { getMeta, openDb, setMeta } from './schema.mjs';
 import { sha256 } from './utils.mjs';
 
 const DEFAULT_INDEX_DIR = join(homedir(), '.retrieval-skill', 'indexes');
@@ -48,9 +48,21 @@ export async function indexPdfVision(pdfPath, name, opts = {}) {
   const documentId = sha256(pdfPath);
   setMeta(db, 'index_name', name);
   setMeta(db, 'source_path', pdfPath);
-  setMeta(db, 'vision_model_id', adapter.modelId());
   setMeta(db, 'vision_adapter', adapter.name);
 
+  // Vectors from another checkpoint (e.g. the other vision backend) are not
+  // comparable, so an unchanged page image is only skipped when the index was
+  // built by the same model. vision_model_id is updated once the pages carry
+  // this model's vectors.
+  const modelId = adapter.modelId();
+  const previousModelId = getMeta(db, 'vision_model_id');
+  const modelChanged = previousModelId !== modelId;
+  if (modelChanged && previousModelId) {
+    console.error(
+      `[vision-index] Index was built with ${previousModelId}; re-embedding all pages with ${modelId}.`,
+    );
+  }
+
   // Extract page images via Python bridge
   const outputDir = join(PAGE_IMAGES_DIR, name, documentId.slice(0, 12));
   mkdirSync(outputDir, { recursive: true });
@@ -93,7 +105,7 @@ export async function indexPdfVision(pdfPath, name, opts = {}) {
       const imgHash = sha256(imgData.toString('base64'));
 
       const existing = getPageByDocPage.get(documentId, pageNum);
-      if (existing && existing.image_hash === imgHash) {
+      if (!modelChanged && existing && existing.image_hash === imgHash) {
         skipped++;
         continue;
       }
@@ -155,6 +167,9 @@ export async function indexPdfVision(pdfPath, name, opts = {}) {
     )
     .get(documentId).cnt;
 
+  // A page that failed to re-embed still holds the old model's vectors; on a
+  // new index, failed pages have none, so the id is always safe to record
+  if (!modelChanged || !previousModelId || errors === 0) setMeta(db, 'vision_model_id', modelId);
   setMeta(db, 'last_vision_indexed_at', new Date().toISOString());
   setMeta(db, 'total_pages', String(totalPages));
   setMeta(db, 'total_page_vectors', String(totalVectors));
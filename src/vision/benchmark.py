@@ -11,9 +11,11 @@ Measures:
 
 import json
 import os
+import platform
+import resource
+import statistics
 import sys
 import time
-import resource
 
 from PIL import Image
 
@@ -37,6 +39,26 @@ def get_peak_memory_mb():
     return usage.ru_maxrss / (1024 * 1024)  # macOS reports in bytes
 
 
+def time_runs(fn, sync):
+    """Median latency of fn in ms over N_RUNS, after N_WARMUP untimed calls.
+
+    sync() blocks until queued GPU work is done, so each sample measures
+    execution rather than async dispatch. Returns (median_ms, last result).
+    """
+    for _ in range(N_WARMUP):
+        fn()
+    sync()
+
+    times = []
+    result = None
+    for _ in range(N_RUNS):
+        t0 = time.perf_counter_ns()
+        result = fn()
+        sync()
+        times.append(time.perf_counter_ns() - t0)
+    return statistics.median(times) / 1e6, result
+
+
 def make_test_image(path="/tmp/bench_page.png"):
     """Create a synthetic page image if no real one exists."""
     img = Image.new("RGB", SYNTHETIC_SIZE, color=(255, 255, 240))
@@ -62,12 +84,13 @@ def benchmark_mlx():
     from mlx_embeddings.models.base import normalize_embeddings
 
     # Model load
-    t0 = time.time()
+    t0 = time.perf_counter()
     model, tokenizer = load("qnguyen3/colqwen2.5-v0.2-mlx")
     image_processor = Qwen2VLImageProcessor.from_pretrained("Qwen/Qwen2.5-VL-3B-Instruct")
-    load_time = time.time() - t0
+    load_time = time.perf_counter() - t0
     print(f"Model load time: {load_time:.2f}s")
-    print(f"Peak memory after load: {get_peak_memory_mb():.0f} MB")
+    load_memory = get_peak_memory_mb()
+    print(f"Peak memory after load: {load_memory:.0f} MB")
 
     def _forward(input_ids, pixel_values=None, image_grid_thw=None, attention_mask=None):
         position_ids, _ = model.vlm.language_model.get_rope_index(
@@ -92,18 +115,9 @@ def benchmark_mlx():
     input_ids = mx.array(inputs["input_ids"])
     attention_mask = mx.array(inputs["attention_mask"])
 
-    # Warmup
-    for _ in range(N_WARMUP):
-        _forward(input_ids, attention_mask=attention_mask)
-
-    times = []
-    for _ in range(N_RUNS):
-        t0 = time.time()
-        emb = _forward(input_ids, attention_mask=attention_mask)
-        times.append(time.time() - t0)
-    avg = sum(times) / len(times)
+    query_ms, emb = time_runs(lambda: _forward(input_ids, attention_mask=attention_mask), mx.synchronize)
     n_vecs = int(mx.sum(attention_mask).item())
-    print(f"  Avg latency: {avg*1000:.1f}ms ({n_vecs} vectors, {emb.shape[2]}d)")
+    print(f"  Median latency: {query_ms:.1f}ms ({n_vecs} vectors, {emb.shape[2]}d)")
 
     # Image embedding
     print(f"\n--- Image Embedding (single) ---")
@@ -116,28 +130,21 @@ def benchmark_mlx():
     n_tokens = int((h_val // 2) * (w_val // 2) * t_val)
     iids = mx.array([[model.image_token_id] * n_tokens])
 
-    # Warmup
-    for _ in range(N_WARMUP):
-        _forward(iids, pixel_values=pv, image_grid_thw=igt)
-
-    times = []
-    for _ in range(N_RUNS):
-        t0 = time.time()
-        emb = _forward(iids, pixel_values=pv, image_grid_thw=igt)
-        times.append(time.time() - t0)
-    avg = sum(times) / len(times)
-    print(f"  Avg latency: {avg*1000:.1f}ms ({emb.shape[1]} vectors, {emb.shape[2]}d)")
+    image_ms, emb = time_runs(lambda: _forward(iids, pixel_values=pv, image_grid_thw=igt), mx.synchronize)
+    peak_memory = get_peak_memory_mb()
+    print(f"  Median latency: {image_ms:.1f}ms ({emb.shape[1]} vectors, {emb.shape[2]}d)")
     print(f"  Image size: {img.size}")
-    print(f"Peak memory: {get_peak_memory_mb():.0f} MB")
+    print(f"Peak memory: {peak_memory:.0f} MB")
 
     return {
         "backend": "mlx",
         "model_load_s": round(load_time, 2),
-        "query_latency_ms": round(avg * 1000, 1),
-        "image_latency_ms": round(sum(times) / len(times) * 1000, 1),
+        "query_latency_ms": round(query_ms, 1),
+        "image_latency_ms": round(image_ms, 1),
         "image_vectors": int(emb.shape[1]),
         "query_vectors": n_vecs,
-        "peak_memory_mb": round(get_peak_memory_mb()),
+        "load_memory_mb": round(load_memory),
+        "peak_memory_mb": round(peak_memory),
     }
 
 
@@ -153,15 +160,22 @@ def benchmark_torch():
     MODEL_ID = "tsystems/colqwen2.5-3b-multilingual-v1.0-merged"
 
     # Model load
-    t0 = time.time()
+    t0 = time.perf_counter()
     device = "mps" if torch.backends.mps.is_available() else "cpu"
     dtype = torch.float32
 
     torch_model = ColQwen2_5.from_pretrained(MODEL_ID, dtype=dtype, device_map=device).eval()
     processor = ColQwen2_5_Processor.from_pretrained(MODEL_ID)
-    load_time = time.time() - t0
+    load_time = time.perf_counter() - t0
     print(f"Model load time: {load_time:.2f}s")
-    print(f"Peak memory after load: {get_peak_memory_mb():.0f} MB")
+    load_memory = get_peak_memory_mb()
+    print(f"Peak memory after load: {load_memory:.0f} MB")
+
+    sync = torch.mps.synchronize if device == "mps" else (lambda: None)
+
+    def _forward(batch):
+        with torch.no_grad():
+            return torch_model(**batch)
 
     # Query embedding
     print(f"\n--- Query Embedding (single) ---")
@@ -170,20 +184,9 @@ def benchmark_torch():
         if isinstance(v, torch.Tensor) and v.is_floating_point():
             batch[k] = v.to(dtype)
 
-    # Warmup
-    for _ in range(N_WARMUP):
-        with torch.no_grad():
-            torch_model(**batch)
-
-    times = []
-    for _ in range(N_RUNS):
-        t0 = time.time()
-        with torch.no_grad():
-            emb = torch_model(**batch)
-        times.append(time.time() - t0)
-    avg = sum(times) / len(times)
+    query_ms, emb = time_runs(lambda: _forward(batch), sync)
     n_vecs = emb.shape[1]
-    print(f"  Avg latency: {avg*1000:.1f}ms ({n_vecs} vectors, {emb.shape[2]}d)")
+    print(f"  Median latency: {query_ms:.1f}ms ({n_vecs} vectors, {emb.shape[2]}d)")
 
     # Image embedding
     print(f"\n--- Image Embedding (single) ---")
@@ -195,35 +198,36 @@ def benchmark_torch():
         if isinstance(v, torch.Tensor) and v.is_floating_point():
             batch[k] = v.to(dtype)
 
-    # Warmup
-    for _ in range(N_WARMUP):
-        with torch.no_grad():
-            torch_model(**batch)
-
-    times = []
-    for _ in range(N_RUNS):
-        t0 = time.time()
-        with torch.no_grad():
-            emb = torch_model(**batch)
-        times.append(time.time() - t0)
-    avg = sum(times) / len(times)
-    print(f"  Avg latency: {avg*1000:.1f}ms ({emb.shape[1]} vectors, {emb.shape[2]}d)")
+    image_ms, emb = time_runs(lambda: _forward(batch), sync)
+    peak_memory = get_peak_memory_mb()
+    print(f"  Median latency: {image_ms:.1f}ms ({emb.shape[1]} vectors, {emb.shape[2]}d)")
     print(f"  Image size: {img.size}")
-    print(f"Peak memory: {get_peak_memory_mb():.0f} MB")
+    print(f"Peak memory: {peak_memory:.0f} MB")
 
     return {
         "backend": "torch+mps",
         "model_load_s": round(load_time, 2),
-        "query_latency_ms": round(avg * 1000, 1),
-        "image_latency_ms": round(sum(times) / len(times) * 1000, 1),
+        "query_latency_ms": round(query_ms, 1),
+        "image_latency_ms": round(image_ms, 1),
         "image_vectors": int(emb.shape[1]),
         "query_vectors": int(n_vecs),
-        "peak_memory_mb": round(get_peak_memory_mb()),
+        "load_memory_mb": round(load_memory),
+        "peak_memory_mb": round(peak_memory),
     }
 
 
+def default_backend():
+    """MLX on Apple Silicon, PyTorch everywhere else (mirrors bridge.mjs)."""
+    env = os.environ.get("VISION_BACKEND")
+    if env:
+        return env
+    if sys.platform == "darwin" and platform.machine() == "arm64":
+        return "mlx"
+    return "torch"
+
+
 if __name__ == "__main__":
-    backend = sys.argv[1] if len(sys.argv) > 1 else "mlx"
+    backend = sys.argv[1] if len(sys.argv) > 1 else default_backend()
     if backend == "mlx":
         result = benchmark_mlx()
     elif backend == "torch":
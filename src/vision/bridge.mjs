@@ -5,10 +5,12 @@
  * communicates via JSON-RPC over stdin/stdout.
  *
  * Supports two backends:
- *   - 'torch' (default): PyTorch + MPS via server.py + venv/
- *   - 'mlx': Apple MLX via server_mlx.py + venv-mlx/
+ *   - 'mlx' (default on Apple Silicon): Apple MLX via server_mlx.py + venv-mlx/
+ *   - 'torch' (default elsewhere): PyTorch + MPS via server.py + venv/
  *
- * Set VISION_BACKEND=mlx environment variable or pass { backend: 'mlx' } to constructor.
+ * Set VISION_BACKEND environment variable or pass { backend } to constructor.
+ * Without either, MLX is used on Apple Silicon when venv-mlx/ is set up,
+ * otherwise PyTorch.
  */
 
 import { spawn } from 'child_process';
@@ -19,26 +21,108 @@ import { fileURLToPath } from 'url';
 
 const __dirname = dirname(fileURLToPath(import.meta.url));
 
+// Servers are started through serve.py, which keeps the process entry script
+// free of torch/MLX imports (render workers re-run it under spawn)
+const LAUNCHER = join(__dirname, 'serve.py');
+
 function getBackendPaths(backend) {
   if (backend === 'mlx') {
     return {
-      script: join(__dirname, 'server_mlx.py'),
+      server: 'server_mlx',
       venvPython: join(__dirname, 'venv-mlx', 'bin', 'python3'),
     };
   }
   return {
-    script: join(__dirname, 'server.py'),
+    server: 'server',
     venvPython: join(__dirname, 'venv', 'bin', 'python3'),
   };
 }
 
+let halfTable = null;
+
+/** float16 bit pattern → float32 value, via a lazily built 64K lookup table. */
+function halfToFloatTable() {
+  if (halfTable) return halfTable;
+  halfTable = new Float32Array(65536);
+  for (let h = 0; h < 65536; h++) {
+    const sign = h & 0x8000 ? -1 : 1;
+    const exp = (h >> 10) & 0x1f;
+    const frac = h & 0x3ff;
+    if (exp === 0) halfTable[h] = sign * frac * 2 ** -24;
+    else if (exp === 31) halfTable[h] = frac ? Number.NaN : sign * Number.POSITIVE_INFINITY;
+    else halfTable[h] = sign * (1 + frac / 1024) * 2 ** (exp - 15);
+  }
+  return halfTable;
+}
+
+/** Decode a base64 payload into a typed array (float16 is widened to float32). */
+function readTyped(base64, dtype) {
+  const bytes = Buffer.from(base64, 'base64');
+  // Copy out of Node's buffer pool so the typed-array view is aligned
+  const buffer = bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.byteLength);
+  switch (dtype) {
+    case 'int8':
+      return new Int8Array(buffer);
+    case 'float32':
+      return new Float32Array(buffer);
+    case 'float16': {
+      const table = halfToFloatTable();
+      const halves = new Uint16Array(buffer);
+      const out = new Float32Array(halves.length);
+      for (let i = 0; i < halves.length; i++) out[i] = table[halves[i]];
+      return out;
+    }
+    default:
+      throw new Error(`Unsupported embedding dtype: ${dtype}`);
+  }
+}
+
+/**
+ * Decode one multi-vector embedding from the server's wire format.
+ * Accepts nested arrays, or a packed { dtype, shape, data, scales? } object with
+ * base64 payloads; int8 codes are multiplied by their per-vector float16 scale.
+ * Returns Float32Array[] (one view per vector over a single buffer).
+ */
+export function decodeEmbedding(encoded) {
+  if (Array.isArray(encoded)) return encoded.map((vec) => new Float32Array(vec));
+
+  const [count, dim] = encoded.shape;
+  const values = readTyped(encoded.data, encoded.dtype);
+  const scales = encoded.scales ? readTyped(encoded.scales, 'float16') : null;
+  const flat = values instanceof Float32Array && !scales ? values : new Float32Array(count * dim);
+  if (flat !== values) {
+    for (let i = 0; i < count; i++) {
+      const scale = scales ? scales[i] : 1;
+      for (let j = i * dim; j < (i + 1) * dim; j++) flat[j] = values[j] * scale;
+    }
+  }
+
+  const vectors = new Array(count);
+  for (let i = 0; i < count; i++) vectors[i] = flat.subarray(i * dim, (i + 1) * dim);
+  return vectors;
+}
+
+/**
+ * Resolve the vision backend: explicit option > VISION_BACKEND > platform default.
+ * MLX runs ColQwen2.5 natively on Metal, so it is the default on Apple Silicon
+ * as long as its venv exists; everything else falls back to PyTorch.
+ */
+export function resolveBackend(backend, { platform = process.platform, arch = process.arch } = {}) {
+  if (backend) return backend;
+  if (process.env.VISION_BACKEND) return process.env.VISION_BACKEND;
+  if (platform === 'darwin' && arch === 'arm64' && existsSync(getBackendPaths('mlx').venvPython)) {
+    return 'mlx';
+  }
+  return 'torch';
+}
+
 export class VisionBridge {
   constructor({ backend } = {}) {
-    this.backend = backend || process.env.VISION_BACKEND || 'torch';
+    this.backend = resolveBackend(backend);
     this.process = null;
     this.readline = null;
     this.requestId = 0;
-    this.pending = new Map(); // id → { resolve, reject }
+    this.pending = new Map(); // id → { resolve, reject, onPartial }
     this.ready = false;
     this._readyPromise = null;
   }
@@ -50,10 +134,10 @@ export class VisionBridge {
   async start() {
     if (this.process) return;
 
-    const { script, venvPython } = getBackendPaths(this.backend);
+    const { server, venvPython } = getBackendPaths(this.backend);
     const pythonBin = existsSync(venvPython) ? venvPython : 'python3';
 
-    this.process = spawn(pythonBin, [script], {
+    this.process = spawn(pythonBin, [LAUNCHER, server], {
       stdio: ['pipe', 'pipe', 'pipe'],
       env: { ...process.env, PYTHONUNBUFFERED: '1' },
     });
@@ -77,7 +161,9 @@ export class VisionBridge {
           if (msg.ready) {
             clearTimeout(timeout);
             this.ready = true;
-            console.error(`[vision-bridge] Server ready: model=${msg.model}, device=${msg.device}`);
+            console.error(
+              `[vision-bridge] Server ready: model=${msg.model}, device=${msg.device}, protocol=${msg.protocol || 1}`,
+            );
             // Now switch to request-response mode
             this.readline.on('line', (l) => this._handleResponse(l));
             resolve(msg);
@@ -117,6 +203,11 @@ export class VisionBridge {
         console.error(`[vision-bridge] Received response for unknown request id: ${id}`);
         return;
       }
+      // Streaming methods send partial messages before their final result
+      if (msg.partial !== undefined) {
+        pending.onPartial?.(msg.partial);
+        return;
+      }
       this.pending.delete(id);
       if (msg.error) {
         pending.reject(new Error(msg.error));
@@ -130,15 +221,16 @@ export class VisionBridge {
 
   /**
    * Send a JSON-RPC request to the Python server.
+   * onPartial receives each partial message of a streaming method.
    */
-  async _call(method, params = {}) {
+  async _call(method, params = {}, onPartial = null) {
     if (!this.ready) throw new Error('Vision server not ready');
 
     const id = ++this.requestId;
     const req = JSON.stringify({ id, method, params });
 
     return new Promise((resolve, reject) => {
-      this.pending.set(id, { resolve, reject });
+      this.pending.set(id, { resolve, reject, onPartial });
       this.process.stdin.write(`${req}\n`);
     });
   }
@@ -154,20 +246,31 @@ export class VisionBridge {
    */
   async embedImages(paths) {
     const result = await this._call('embed_images', { paths });
-    // Convert nested arrays to Float32Arrays
     return {
-      embeddings: result.embeddings.map((pageVecs) => pageVecs.map((vec) => new Float32Array(vec))),
+      embeddings: result.embeddings.map(decodeEmbedding),
       num_vectors: result.num_vectors,
     };
   }
 
+  /**
+   * Embed page images, receiving each page as soon as the server finishes it.
+   * onPage({ index, embedding: Float32Array[], num_vectors }) runs once per page,
+   * not necessarily in path order.
+   * Returns { num_vectors: number[] } once every page has been delivered.
+   */
+  async embedImagesStream(paths, onPage) {
+    return this._call('embed_images_stream', { paths }, (page) =>
+      onPage({ ...page, embedding: decodeEmbedding(page.embedding) }),
+    );
+  }
+
   /**
    * Embed a single query text.
    * Returns Float32Array[] (array of token vectors).
    */
   async embedQuery(text) {
     const result = await this._call('embed_query', { text });
-    return result.embedding.map((vec) => new Float32Array(vec));
+    return decodeEmbedding(result.embedding);
   }
 
   /**
@@ -176,7 +279,7 @@ export class VisionBridge {
    */
   async embedQueries(texts) {
     const result = await this._call('embed_queries', { texts });
-    return result.embeddings.map((queryVecs) => queryVecs.map((vec) => new Float32Array(vec)));
+    return result.embeddings.map(decodeEmbedding);
   }
 
   /**
@@ -187,6 +290,19 @@ export class VisionBridge {
     return this._call('extract_pages', { pdf_path: pdfPath, output_dir: outputDir });
   }
 
+  /**
+   * Rasterize and embed every page of a PDF in one call, without writing PNGs
+   * unless outputDir is given.
+   * Returns { embeddings: Float32Array[][], num_vectors: number[], page_count: number, paths: string[] }
+   */
+  async extractAndEmbed(pdfPath, outputDir = null) {
+    const result = await this._call('extract_and_embed', { pdf_path: pdfPath, output_dir: outputDir });
+    return {
+      ...result,
+      embeddings: result.embeddings.map(decodeEmbedding),
+    };
+  }
+
   /**
    * Extract text from each page of a PDF.
    * Uses PyMuPDF text extraction, with pytesseract OCR fallback for image-only pages.
@@ -0,0 +1,316 @@
+"""
+Helpers shared by server.py and server_mlx.py.
+
+LRU caches, embedding wire encoding, JSON-RPC line output, and the PDF side
+of the protocol: page rasterization in worker processes, the open-document
+cache, and text extraction with OCR fallback. Model code and batching stay
+in the servers.
+
+Render workers unpickle _render_pages from this module, which imports only
+PyMuPDF, numpy and orjson. Under spawn (macOS) a worker also re-runs the
+process entry script, so the bridge starts the servers through serve.py;
+see there.
+"""
+
+import base64
+import collections
+import functools
+import itertools
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+import numpy as np
+import orjson
+
+# Prefix for log lines; server_mlx.py sets its own
+LOG_NAME = "vision-server"
+
+# PDF pages are rasterized in worker processes (MuPDF documents are not
+# thread-safe); the pool is created on first use and lives for the server.
+PAGE_DPI = 144
+VISION_RENDER_WORKERS = int(os.environ.get("VISION_RENDER_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+_render_pool = None
+# Most pages one render task covers. Pages are spread evenly over the workers,
+# and long documents split finer so the first pages reach the model early.
+RENDER_CHUNK_MAX = 4
+# Render tasks in flight per worker (submitted but not yet consumed)
+RENDER_WINDOW = 2
+# US Letter in points; the servers warm up on a blank page rendered from it
+WARMUP_PAGE_RECT = fitz.Rect(0, 0, 612, 792)
+
+# Open fitz.Document handles kept between requests, keyed by path and
+# checked against mtime, so extract_pages then extract_text parse a PDF once.
+# Only the request thread touches them (render workers open their own).
+DOC_CACHE_MAX = 4
+_DOC_CACHE = collections.OrderedDict()
+
+# Threads running tesseract on image-only pages in extract_text
+VISION_OCR_WORKERS = max(1, int(os.environ.get("VISION_OCR_WORKERS", os.cpu_count() or 1)))
+# Render DPI for OCR; tesseract gains little above 200 DPI on printed text
+VISION_OCR_DPI = int(os.environ.get("VISION_OCR_DPI", "200"))
+
+
+def log(msg):
+    """Log to stderr (stdout is reserved for JSON-RPC)."""
+    print(f"[{LOG_NAME}] {msg}", file=sys.stderr, flush=True)
+
+
+def cache_get(cache, key):
+    """Return the cached value for key (refreshing its LRU position), or None."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def cache_put(cache, key, value, capacity):
+    """Insert into an LRU cache, evicting the oldest entries beyond capacity."""
+    if capacity <= 0:
+        return
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > capacity:
+        cache.popitem(last=False)
+
+
+def safe_json_dumps(obj):
+    """Serialize to JSON bytes with orjson. Numpy arrays are written directly by
+    its C encoder (no per-float Python objects), and NaN/Infinity become null."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def write_message(obj):
+    """Write one JSON line to stdout (binary, no text-layer encoding)."""
+    sys.stdout.buffer.write(safe_json_dumps(obj) + b"\n")
+    sys.stdout.buffer.flush()
+
+
+def pack(arr):
+    """Base64-pack a numpy array as {"dtype", "shape", "data"}."""
+    return {
+        "dtype": arr.dtype.name,
+        "shape": list(arr.shape),
+        "data": base64.b64encode(arr.tobytes()).decode("ascii"),
+    }
+
+
+def encode_page(vecs, encoding):
+    """Encode one page's (num_vectors, dim) host array for the wire.
+
+    "int8" keeps one float16 scale per vector (max |x| / 127), so the bridge
+    reconstructs x ~= scale * code; "float16" packs the raw values; anything
+    else sends nested lists. Those are written from float32, since orjson
+    cannot serialize float16 arrays.
+    """
+    if encoding == "float16":
+        return pack(vecs.astype(np.float16, copy=False))
+    if encoding == "int8":
+        scales = (np.abs(vecs).max(axis=1, keepdims=True) / 127.0).astype(np.float16)
+        divisor = np.where(scales > 0, scales, 1).astype(np.float32)
+        codes = np.clip(np.rint(vecs / divisor), -127, 127).astype(np.int8)
+        packed = pack(codes)
+        packed["scales"] = base64.b64encode(scales.tobytes()).decode("ascii")
+        return packed
+    return vecs.astype(np.float32, copy=False)
+
+
+def encode_query(vecs, encoding):
+    """Encode one query's (num_vectors, dim) host array; queries are never int8."""
+    if encoding == "float16":
+        return pack(vecs.astype(np.float16, copy=False))
+    return vecs.astype(np.float32, copy=False)
+
+
+def page_zoom(rect, target_pixels):
+    """Zoom that renders a page at the processor's pixel budget, so MuPDF does the
+    anti-aliased downscale in one pass. Never exceeds 144 DPI."""
+    zoom = PAGE_DPI / 72
+    if target_pixels:
+        zoom = min(zoom, math.sqrt(target_pixels / (rect.width * rect.height)))
+    return zoom
+
+
+def rendered_size(rect, target_pixels):
+    """(width, height) of the pixmap _render_pages produces for a page of rect."""
+    zoom = page_zoom(rect, target_pixels)
+    bbox = (rect * fitz.Matrix(zoom, zoom)).irect
+    return bbox.width, bbox.height
+
+
+def open_doc(pdf_path):
+    """Return an open fitz.Document for pdf_path from the document LRU,
+    reopening it if the file changed. Evicted documents are closed."""
+    path = os.path.abspath(pdf_path)
+    mtime = os.stat(path).st_mtime_ns
+    entry = cache_get(_DOC_CACHE, path)
+    if entry is not None:
+        if entry[0] == mtime:
+            return entry[1]
+        del _DOC_CACHE[path]
+        entry[1].close()
+
+    doc = fitz.open(path)
+    _DOC_CACHE[path] = (mtime, doc)
+    while len(_DOC_CACHE) > DOC_CACHE_MAX:
+        _, (_, evicted) = _DOC_CACHE.popitem(last=False)
+        evicted.close()
+    return doc
+
+
+def _render_pages(pdf_path, page_nums, output_dir=None, keep_pixels=True, target_pixels=None):
+    """Rasterize a run of pages (runs in a worker process, which opens its own
+    document). Returns (width, height, rgb_bytes or None, png_path or None) per
+    page; PNGs are only written when output_dir is given."""
+    doc = fitz.open(pdf_path)
+    try:
+        pages = []
+        for page_num in page_nums:
+            page = doc[page_num]
+            zoom = page_zoom(page.rect, target_pixels)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            img_path = None
+            if output_dir:
+                img_path = os.path.join(output_dir, f"page_{page_num:04d}.png")
+                pix.save(img_path)
+            pages.append((pix.width, pix.height, pix.samples if keep_pixels else None, img_path))
+        return pages
+    finally:
+        doc.close()
+
+
+def batched(items, size):
+    """Group an iterable into lists of up to size items, preserving order."""
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
+def rendered_pages(pdf_path, target_pixels=None, output_dir=None, keep_pixels=True):
+    """Yield rendered pages in document order.
+
+    Rendering is split into render tasks of ceil(pages / workers) pages (at
+    most RENDER_CHUNK_MAX) that run in parallel, so later pages rasterize
+    while earlier ones embed. At most RENDER_WINDOW tasks per worker are in
+    flight, so a slow consumer bounds how many page buffers pile up. Callers
+    batch the pages for the model separately.
+    """
+    page_count = len(open_doc(pdf_path))
+    workers = max(1, min(VISION_RENDER_WORKERS, page_count))
+    chunk_size = max(1, min(RENDER_CHUNK_MAX, math.ceil(page_count / workers)))
+
+    chunks = [
+        range(start, min(start + chunk_size, page_count))
+        for start in range(0, page_count, chunk_size)
+    ]
+    render = functools.partial(
+        _render_pages,
+        pdf_path,
+        output_dir=output_dir,
+        keep_pixels=keep_pixels,
+        target_pixels=target_pixels,
+    )
+    if len(chunks) <= 1 or VISION_RENDER_WORKERS <= 1:
+        return itertools.chain.from_iterable(map(render, chunks))
+
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=VISION_RENDER_WORKERS)
+    return itertools.chain.from_iterable(
+        _bounded_map(_render_pool, render, chunks, RENDER_WINDOW * VISION_RENDER_WORKERS)
+    )
+
+
+def _bounded_map(pool, fn, items, window):
+    """Like pool.map, but keeps at most window tasks submitted and not yet
+    consumed; a new task is submitted as each result is taken."""
+    items = iter(items)
+    pending = collections.deque(pool.submit(fn, item) for item in itertools.islice(items, window))
+    while pending:
+        result = pending.popleft().result()
+        for item in itertools.islice(items, 1):
+            pending.append(pool.submit(fn, item))
+        yield result
+
+
+def shutdown_render_pool():
+    """Stop the render workers, if any were started."""
+    if _render_pool is not None:
+        _render_pool.shutdown()
+
+
+def extract_pages(pdf_path, output_dir, target_pixels=None):
+    """Extract page images from a PDF using PyMuPDF.
+    Returns list of output image paths and page count."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [
+        img_path
+        for _, _, _, img_path in rendered_pages(
+            pdf_path, target_pixels=target_pixels, output_dir=output_dir, keep_pixels=False
+        )
+    ]
+    return {"paths": paths, "page_count": len(paths)}
+
+
+def _ocr_page(pytesseract, page_num, pixels):
+    """OCR one rendered (height, width, 3) page (runs on an OCR thread). Returns (text, method)."""
+    try:
+        return pytesseract.image_to_string(pixels).strip(), "tesseract"
+    except Exception as e:
+        log(f"OCR failed on page {page_num}: {e}")
+        return "", "ocr_failed"
+
+
+def extract_text(pdf_path):
+    """Extract text content from each page of a PDF using PyMuPDF.
+    For pages with no embedded text (image-only), attempts OCR via pytesseract if available.
+    OCR runs on VISION_OCR_WORKERS threads, each waiting on its own tesseract process.
+    Returns list of { page_number, text, method } objects."""
+    doc = open_doc(pdf_path)
+    pages = []
+    has_tesseract = False
+    try:
+        import pytesseract
+        has_tesseract = True
+    except ImportError:
+        pass
+
+    # Bounds rendered-but-not-yet-OCRed pages (~11 MB each at 200 DPI)
+    slots = threading.BoundedSemaphore(VISION_OCR_WORKERS * 2)
+    ocr_jobs = {}
+    with ThreadPoolExecutor(max_workers=VISION_OCR_WORKERS) as pool:
+        for page_num in range(len(doc)):
+            page = doc[page_num]
+            text = page.get_text().strip()
+            method = "pymupdf"
+
+            if not text and has_tesseract:
+                # OCR fallback for image-only pages. Rendering stays on this
+                # thread: MuPDF documents are not thread-safe.
+                slots.acquire()
+                try:
+                    pix = page.get_pixmap(dpi=VISION_OCR_DPI, alpha=False)
+                    # Hand the pixmap bytes to the OCR thread as an array view;
+                    # pytesseract still builds a PIL image from it there
+                    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+                    job = pool.submit(_ocr_page, pytesseract, page_num, pixels)
+                    job.add_done_callback(lambda _: slots.release())
+                    ocr_jobs[page_num] = job
+                except Exception as e:
+                    slots.release()
+                    log(f"OCR failed on page {page_num}: {e}")
+                    method = "ocr_failed"
+
+            pages.append({
+                "page_number": page_num,
+                "text": text,
+                "method": method,
+            })
+
+        for page_num, job in ocr_jobs.items():
+            pages[page_num]["text"], pages[page_num]["method"] = job.result()
+
+    return {"pages": pages, "has_tesseract": has_tesseract}
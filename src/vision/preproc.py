@@ -0,0 +1,160 @@
+"""
+Qwen2-VL image preprocessing for the MLX vision server.
+
+Reproduces Qwen2VLImageProcessor (smart resize -> rescale -> normalize ->
+patchify) with rescale and normalize fused into a single pass over the pixel
+buffer. That pass is JIT-compiled with Numba when it is installed and falls
+back to vectorized numpy otherwise.
+"""
+
+import math
+
+import numpy as np
+from PIL import Image
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Qwen2-VL processor constants (OpenAI CLIP normalization)
+IMAGE_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+IMAGE_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+PATCH_SIZE = 14
+MERGE_SIZE = 2
+TEMPORAL_PATCH_SIZE = 2
+# transformers' Qwen2-VL smart_resize rejects more extreme aspect ratios
+MAX_ASPECT_RATIO = 200
+
+# (x / 255 - mean) / std folded into one multiply-add per channel
+_SCALE = (1.0 / (255.0 * IMAGE_STD)).astype(np.float32)
+_SHIFT = (-IMAGE_MEAN / IMAGE_STD).astype(np.float32)
+
+
+def smart_resize(height, width, min_pixels, max_pixels, factor=PATCH_SIZE * MERGE_SIZE):
+    """Target (height, width): multiples of factor, area within [min_pixels, max_pixels],
+    aspect ratio preserved. Same rounding as transformers' Qwen2-VL smart_resize."""
+    if max(height, width) / min(height, width) > MAX_ASPECT_RATIO:
+        raise ValueError(
+            f"absolute aspect ratio must be smaller than {MAX_ASPECT_RATIO}, "
+            f"got {max(height, width) / min(height, width)}"
+        )
+    h_bar = round(height / factor) * factor
+    w_bar = round(width / factor) * factor
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+def _normalize_numpy(rgb, out, scale, shift):
+    np.multiply(np.moveaxis(rgb, 2, 0), scale[:, None, None], out=out, casting="unsafe")
+    out += shift[:, None, None]
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_jit(rgb, out, scale, shift):
+        height, width, channels = rgb.shape
+        for y in numba.prange(height):
+            for x in range(width):
+                for c in range(channels):
+                    out[c, y, x] = rgb[y, x, c] * scale[c] + shift[c]
+
+    _normalize_kernel = _normalize_jit
+else:
+    _normalize_kernel = _normalize_numpy
+
+
+def normalize(rgb):
+    """uint8 HWC RGB -> float32 CHW, rescaled and CLIP-normalized in one pass."""
+    out = np.empty((rgb.shape[2], rgb.shape[0], rgb.shape[1]), dtype=np.float32)
+    _normalize_kernel(rgb, out, _SCALE, _SHIFT)
+    return out
+
+
+def patchify(chw, dtype=np.float32):
+    """CHW image -> (flattened patches [grid_h * grid_w, 1176], grid (t, h, w)).
+    A still image fills the temporal patch by repeating itself. The patch
+    gather and the cast to dtype happen in the same copy."""
+    channels, height, width = chw.shape
+    grid_h, grid_w = height // PATCH_SIZE, width // PATCH_SIZE
+    patches = np.broadcast_to(chw, (TEMPORAL_PATCH_SIZE, channels, height, width))
+    patches = patches.reshape(
+        1,
+        TEMPORAL_PATCH_SIZE,
+        channels,
+        grid_h // MERGE_SIZE,
+        MERGE_SIZE,
+        PATCH_SIZE,
+        grid_w // MERGE_SIZE,
+        MERGE_SIZE,
+        PATCH_SIZE,
+    )
+    patches = patches.transpose(0, 3, 6, 4, 7, 2, 1, 5, 8)
+    flat = np.empty(patches.shape, dtype=dtype)
+    np.copyto(flat, patches, casting="same_kind")
+    return flat.reshape(grid_h * grid_w, -1), (1, grid_h, grid_w)
+
+
+def to_rgb(img):
+    """PIL image -> RGB the way transformers' convert_to_rgb does it: other modes
+    go through RGBA and are composited onto white, so transparent areas come
+    out white rather than whatever color the dropped alpha was hiding."""
+    if img.mode == "RGB":
+        return img
+    rgba = img.convert("RGBA")
+    return Image.alpha_composite(Image.new("RGBA", rgba.size, (255, 255, 255)), rgba).convert("RGB")
+
+
+def _preprocess_at(img, height, width, dtype):
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.BICUBIC)
+    return patchify(normalize(np.asarray(img, dtype=np.uint8)), dtype)
+
+
+def preprocess(img, min_pixels, max_pixels, dtype=np.float32):
+    """PIL image -> (pixel_values, grid_thw) as Qwen2VLImageProcessor would produce,
+    with pixel_values in dtype (float16 matches a half-precision vision tower)."""
+    height, width = smart_resize(img.height, img.width, min_pixels, max_pixels)
+    return _preprocess_at(to_rgb(img), height, width, dtype)
+
+
+def file_grid(path, min_pixels, max_pixels):
+    """grid_thw load_and_preprocess will produce for an image file, read from
+    the file header alone (no pixels are decoded)."""
+    with Image.open(path) as img:
+        height, width = smart_resize(img.height, img.width, min_pixels, max_pixels)
+    return 1, height // PATCH_SIZE, width // PATCH_SIZE
+
+
+def load_and_preprocess(path, min_pixels, max_pixels, dtype=np.float32):
+    """Image file -> (pixel_values, grid_thw), decoding no more pixels than needed.
+
+    The target size comes from the file's full dimensions. JPEGs then decode
+    at the smallest DCT scale that still covers it, so their pixels can
+    differ slightly from a full decode. Files that are already RGB skip the
+    to_rgb copy.
+    """
+    with Image.open(path) as img:
+        height, width = smart_resize(img.height, img.width, min_pixels, max_pixels)
+        if img.format == "JPEG":
+            img.draft("RGB", (width, height))
+        return _preprocess_at(to_rgb(img), height, width, dtype)
+
+
+def warmup():
+    """Compile the normalize kernel ahead of the first request.
+
+    Pages arrive as np.asarray views of PIL images, which are read-only, and
+    Numba compiles read-only and writable arrays separately; warm up on the
+    same kind of array so the first page reuses this compilation.
+    """
+    side = PATCH_SIZE * MERGE_SIZE
+    normalize(np.asarray(Image.new("RGB", (side, side)), dtype=np.uint8))
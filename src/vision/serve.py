@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Entry point the Node.js bridge runs: `python3 serve.py server` (PyTorch) or
+`python3 serve.py server_mlx` (MLX).
+
+PDF render workers (common.py) are separate processes. Where they start with
+spawn (the default on macOS), each worker re-runs the entry script as
+__mp_main__, so the entry script must not import torch, MLX or numba at module
+level. The servers do; this launcher imports nothing heavy and loads the
+server module only in the parent process. Running server.py directly still
+works, but then every render worker pays for those imports.
+"""
+
+import importlib
+import sys
+
+SERVERS = ("server", "server_mlx")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in SERVERS:
+        sys.exit(f"usage: serve.py {{{'|'.join(SERVERS)}}}")
+    importlib.import_module(sys.argv[1]).main()
@@ -11,26 +11,77 @@ Requests:
   {"id": 2, "method": "embed_query", "params": {"text": "search query"}}
   {"id": 3, "method": "embed_queries", "params": {"texts": ["q1", "q2"]}}
   {"id": 4, "method": "extract_pages", "params": {"pdf_path": "/path/to/file.pdf", "output_dir": "/tmp/pages"}}
+  {"id": 7, "method": "extract_and_embed", "params": {"pdf_path": "/path/to/file.pdf", "output_dir": null}}
+  {"id": 8, "method": "embed_images_stream", "params": {"paths": ["/path/to/img.png", ...]}}
   {"id": 5, "method": "health"}
   {"id": 6, "method": "shutdown"}
 
 Responses:
-  {"id": 1, "result": {"embeddings": [[[0.1, 0.2, ...], ...], ...], "num_vectors": [700, 680]}}
+  {"id": 1, "result": {"embeddings": [{"dtype": "int8", "shape": [700, 128], "data": "<b64>", "scales": "<b64>"}, ...],
+                       "num_vectors": [700, 680]}}
   {"id": 2, "result": {"embedding": [[0.1, 0.2, ...], ...]}}
+  {"id": 7, "result": {"embeddings": [...], "num_vectors": [...], "page_count": 2, "paths": []}}
+  {"id": 8, "partial": {"index": 0, "embedding": {...}, "num_vectors": 700}}   (one line per page, then)
+  {"id": 8, "result": {"num_vectors": [700, 680]}}
   {"id": 5, "result": {"status": "ok", "model": "...", "device": "mps", "dtype": "float32"}}
+
+Page embeddings use VISION_EMBEDDING_ENCODING: "int8" (default) packs each page
+as base64 int8 codes plus one float16 scale per vector (x ~= scale * code);
+"float16" packs base64 float16 {"dtype", "shape", "data"}; "json" sends nested
+float lists. Query embeddings are always nested lists.
 """
 
-import json
-import math
+import collections
+import contextlib
+import hashlib
 import sys
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
 import torch
-import fitz  # PyMuPDF
 from PIL import Image
 from io import BytesIO
-from prometheus_client import Counter, Histogram, Gauge, start_http_server
+from transformers import BatchFeature
+
+import common
+from common import cache_get, cache_put, log, write_message
+
+# Metrics are on by default; VISION_METRICS=0 (or a missing prometheus_client)
+# swaps in no-op collectors so benchmarks and dev runs skip the HTTP server.
+VISION_METRICS = os.environ.get("VISION_METRICS", "1") == "1"
+if VISION_METRICS:
+    try:
+        from prometheus_client import Counter, Histogram, Gauge, start_http_server
+    except ImportError:
+        VISION_METRICS = False
+
+
+class _NoopMetric:
+    """Stand-in for a prometheus_client collector when metrics are disabled."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    def set(self, value):
+        pass
+
+    def time(self):
+        return contextlib.nullcontext()
+
+
+if not VISION_METRICS:
+    Counter = Histogram = Gauge = _NoopMetric
 
 
 # Globals — set on init
@@ -40,16 +91,46 @@ device = None
 dtype = None
 MODEL_ID = "tsystems/colqwen2.5-3b-multilingual-v1.0-merged"
 
+# Weight precision. "auto" keeps the per-device default chosen in init_model;
+# "fp32"/"fp16"/"bf16" force a dtype; "4bit" loads NF4 weights via bitsandbytes
+# (CUDA only — other devices keep their default dtype).
+VISION_QUANT = os.environ.get("VISION_QUANT", "auto").lower()
+QUANT_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
 # --- Prometheus metrics ---
 EMBED_REQUESTS = Counter(
     "vision_embed_requests_total",
     "Total embedding requests",
     ["method"],
 )
+# Bucket schedules sized to each path: queries take tens of milliseconds,
+# image batches take seconds, so the prometheus_client defaults blur both.
 EMBED_DURATION = Histogram(
     "vision_embed_duration_seconds",
-    "Embedding request duration in seconds",
+    "Duration of non-embedding requests (page extraction) in seconds",
+    ["method"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+QUERY_DURATION = Histogram(
+    "vision_embed_query_duration_seconds",
+    "Query embedding request duration in seconds",
+    ["method"],
+    buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5),
+)
+IMAGE_DURATION = Histogram(
+    "vision_embed_image_duration_seconds",
+    "Image embedding request duration in seconds",
     ["method"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0),
+)
+BATCH_SIZE = Histogram(
+    "vision_batch_size",
+    "Page images per embedding request",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBED_VECTORS = Counter(
+    "vision_embed_vectors_total",
+    "Total page embedding vectors produced",
 )
 PAGES_PROCESSED = Counter(
     "vision_pages_processed_total",
@@ -59,30 +140,153 @@ MODEL_MEMORY = Gauge(
     "vision_model_memory_bytes",
     "Estimated model memory usage in bytes",
 )
+VISION_CACHE_HITS = Counter(
+    "vision_cache_hits_total",
+    "Page images served from the content-hash embedding cache",
+)
+NAN_BATCHES = Counter(
+    "vision_nan_batches_total",
+    "Sampled image batches whose embeddings contained NaN",
+)
+
+QUERY_CACHE_HITS = Counter(
+    "vision_query_cache_hits_total",
+    "Queries served from the query embedding cache",
+)
+
+# NaN sampling interval in image batches (0 disables the check)
+VISION_NAN_CHECK_EVERY = int(os.environ.get("VISION_NAN_CHECK_EVERY", "16"))
+_nan_checks = 0
+
+# LRU of page embeddings keyed by a hash of the decoded pixels, so re-embedding
+# the same page (re-index, repeated retrieval) skips the model entirely.
+VISION_CACHE_MAX = int(os.environ.get("VISION_CACHE_MAX", "128"))
+VISION_CACHE = collections.OrderedDict()
+
+# LRU of query embeddings keyed by a hash of the query text; search traffic
+# repeats a narrow set of queries, and a hit skips the forward pass.
+VISION_QUERY_CACHE_MAX = int(os.environ.get("VISION_QUERY_CACHE_MAX", "256"))
+_QUERY_EMB_CACHE = collections.OrderedDict()
+
+# Wire format for page embeddings; see the module docstring. Unknown values
+# fall back to the default with a warning in init_model.
+EMBEDDING_ENCODINGS = ("int8", "float16", "json")
+VISION_EMBEDDING_ENCODING = os.environ.get("VISION_EMBEDDING_ENCODING", "int8").lower()
+PROTOCOL_VERSION = 2
+
+# Upper bound on images per forward pass. Keep page sizes and this cap stable
+# across runs so MPS can reuse its compiled graphs instead of growing the cache.
+VISION_MAX_BATCH = max(1, int(os.environ.get("VISION_MAX_BATCH", "8")))
+
+# Pixel budget of the processor's resize (Qwen2-VL max_pixels), read in
+# init_model. Pages are rendered straight to this size instead of 144 DPI.
+TARGET_PIXELS = None
+
+# Warmup compiles kernels for a US Letter page rendered at TARGET_PIXELS
+# (common.WARMUP_PAGE_RECT), the shape real PDF pages arrive in
+VISION_SKIP_WARMUP = os.environ.get("VISION_SKIP_WARMUP", "0") == "1"
+
+# Query prompt split into fixed token ids around the user text (set by
+# _init_query_template); None means fall back to processor.process_queries.
+QUERY_PREFIX_IDS = None
+QUERY_SUFFIX_IDS = None
+QUERY_LEAD = ""
+QUERY_TEMPLATE_PROBES = ["warmup", "vegetarian pasta under 30 minutes", "Ünïcödé 42? (x-y)"]
 
 
 def start_metrics_server():
     """Start a Prometheus metrics HTTP server on a background thread."""
+    if not VISION_METRICS:
+        log("Prometheus metrics disabled.")
+        return
     port = int(os.environ.get("VISION_METRICS_PORT", "8300"))
     start_http_server(port)
     log(f"Prometheus metrics server listening on :{port}")
 
 
 def _estimate_model_memory():
-    """Estimate model parameter memory in bytes."""
+    """Estimate model parameter memory in bytes (packed 4-bit weights count as stored)."""
     if model is None:
         return 0
-    total = 0
-    for p in model.parameters():
-        total += p.nelement() * p.element_size()
-    for b in model.buffers():
-        total += b.nelement() * b.element_size()
-    return total
+    return model.get_memory_footprint()
+
+
+def _processor_max_pixels():
+    """Pixel budget the image processor resizes pages down to, or None if unknown."""
+    image_processor = processor.image_processor
+    max_pixels = getattr(image_processor, "max_pixels", None)
+    if not max_pixels:
+        # Qwen2-VL keeps the pixel budget (not an edge length) under size["longest_edge"]
+        max_pixels = (getattr(image_processor, "size", None) or {}).get("longest_edge")
+    return max_pixels
+
+
+def _init_query_template():
+    """Pre-tokenize the fixed parts of the ColQwen query prompt.
+
+    The prompt is query_prefix + text + augmentation suffix. Whitespace at the
+    end of the prefix belongs to the first word under BPE, so it is tokenized
+    with the text. The split is checked against process_queries on a few
+    probes; on any mismatch the fast path stays disabled.
+    """
+    global QUERY_PREFIX_IDS, QUERY_SUFFIX_IDS, QUERY_LEAD
+    prefix = getattr(processor, "query_prefix", None)
+    if prefix is None:
+        log("Query template: processor has no query_prefix; using process_queries.")
+        return
+
+    tokenizer = processor.tokenizer
+    head = prefix.rstrip()
+    lead = prefix[len(head):]
+    prefix_ids = tokenizer(head, add_special_tokens=False)["input_ids"] if head else []
+
+    suffix_ids = None
+    for probe in QUERY_TEMPLATE_PROBES:
+        expected = processor.process_queries([probe])["input_ids"][0].tolist()
+        body = tokenizer(lead + probe, add_special_tokens=False)["input_ids"]
+        if suffix_ids is None:
+            suffix_ids = expected[len(prefix_ids) + len(body):]
+        if prefix_ids + body + suffix_ids != expected:
+            log("Query template: token splice differs from process_queries; using process_queries.")
+            return
+
+    QUERY_PREFIX_IDS, QUERY_SUFFIX_IDS, QUERY_LEAD = prefix_ids, suffix_ids, lead
+
+
+def _tokenize_queries(texts):
+    """Build the query batch, tokenizing only the user text when the template is cached."""
+    if QUERY_PREFIX_IDS is None:
+        return processor.process_queries(texts)
+    tokenizer = processor.tokenizer
+    bodies = tokenizer([QUERY_LEAD + text for text in texts], add_special_tokens=False)["input_ids"]
+    input_ids = [QUERY_PREFIX_IDS + body + QUERY_SUFFIX_IDS for body in bodies]
+    padded = tokenizer.pad({"input_ids": input_ids}, padding="longest", return_tensors="pt")
+    return BatchFeature(data=dict(padded))
+
+
+def _four_bit_config():
+    """NF4 quantization config for VISION_QUANT=4bit, or None if unsupported here.
+    The 128-dim projection head stays in fp16 so normalized outputs keep their precision."""
+    if not str(device).startswith("cuda"):
+        log(f"WARNING: VISION_QUANT=4bit requires CUDA (bitsandbytes); keeping {dtype} on {device}.")
+        return None
+    try:
+        import bitsandbytes  # noqa: F401
+        from transformers import BitsAndBytesConfig
+    except ImportError:
+        log("WARNING: VISION_QUANT=4bit requires bitsandbytes; loading unquantized weights.")
+        return None
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+        llm_int8_skip_modules=["custom_text_proj"],
+    )
 
 
 def init_model():
     """Load model onto MPS with float32 or float16 (NOT bfloat16)."""
-    global model, processor, device, dtype
+    global model, processor, device, dtype, TARGET_PIXELS, VISION_EMBEDDING_ENCODING
 
     # Determine device and dtype
     if torch.backends.mps.is_available():
@@ -96,33 +300,128 @@ def init_model():
         device = "cpu"
         dtype = torch.float32
 
-    log(f"Loading {MODEL_ID} on {device} with {dtype}...")
+    load_kwargs = {}
+    if VISION_QUANT in QUANT_DTYPES:
+        dtype = QUANT_DTYPES[VISION_QUANT]
+    elif VISION_QUANT == "4bit":
+        quant_config = _four_bit_config()
+        if quant_config is not None:
+            load_kwargs["quantization_config"] = quant_config
+            dtype = torch.float16
+    elif VISION_QUANT != "auto":
+        log(f"WARNING: Unknown VISION_QUANT={VISION_QUANT!r}; using {dtype}.")
 
-    from colpali_engine.models import ColQwen2_5, ColQwen2_5_Processor
+    if VISION_EMBEDDING_ENCODING not in EMBEDDING_ENCODINGS:
+        log(f"WARNING: Unknown VISION_EMBEDDING_ENCODING={VISION_EMBEDDING_ENCODING!r}; using int8.")
+        VISION_EMBEDDING_ENCODING = "int8"
 
-    model = ColQwen2_5.from_pretrained(
-        MODEL_ID,
-        dtype=dtype,
-        device_map=device,
-    ).eval()
+    log(f"Loading {MODEL_ID} on {device} with {dtype} (quant={VISION_QUANT})...")
+
+    from colpali_engine.models import ColQwen2_5, ColQwen2_5_Processor
 
-    processor = ColQwen2_5_Processor.from_pretrained(MODEL_ID)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Tokenizer and image-processor files load while the weights stream in
+        processor_future = pool.submit(ColQwen2_5_Processor.from_pretrained, MODEL_ID)
+
+        # device_map makes accelerate build the model on the meta device and
+        # place each checkpoint shard directly on `device`, so weights are never
+        # materialized twice (on CPU and then again on MPS).
+        model = ColQwen2_5.from_pretrained(
+            MODEL_ID,
+            dtype=dtype,
+            device_map=device,
+            low_cpu_mem_usage=True,
+            **load_kwargs,
+        ).eval()
+
+        processor = processor_future.result()
+
+    TARGET_PIXELS = _processor_max_pixels()
+    _init_query_template()
     log(f"Model loaded. Device={device}, dtype={dtype}")
 
+    if VISION_SKIP_WARMUP:
+        log("Skipping warmup (VISION_SKIP_WARMUP=1).")
+    else:
+        _warmup()
+
     MODEL_MEMORY.set(_estimate_model_memory())
 
 
-def log(msg):
-    """Log to stderr (stdout is reserved for JSON-RPC)."""
-    print(f"[vision-server] {msg}", file=sys.stderr, flush=True)
+def _warmup():
+    """Run one query and one page through the model before signalling ready,
+    so the first real request does not pay for MPS kernel compilation."""
+    log("Warming up...")
+    page = Image.new("RGB", common.rendered_size(common.WARMUP_PAGE_RECT, TARGET_PIXELS), "white")
+    with torch.inference_mode():
+        model(**_to_model(_tokenize_queries(["warmup"])))
+        model(**_to_model(processor.process_images([page])))
+    if device == "mps":
+        torch.mps.synchronize()
+    log("Warmup complete.")
+
+
+def _to_model(batch):
+    """Move a processor batch to the model device in one call. BatchFeature.to
+    casts only floating tensors to the model dtype; ids and masks keep theirs."""
+    return batch.to(device=model.device, dtype=dtype, non_blocking=True)
 
 
 def _run_image_embedding(batch):
     """Run the model forward pass on a processed image batch."""
-    with torch.no_grad():
+    with torch.inference_mode():
         return model(**batch)  # shape: (batch, num_patches, dim)
 
 
+def _to_numpy(embeddings):
+    """Copy a whole (batch, num_vectors, dim) output to host as float32 in one
+    transfer; callers slice pages out in numpy. Arrays stay numpy all the way to
+    safe_json_dumps, which serializes them in C."""
+    return embeddings.detach().to("cpu", dtype=torch.float32).numpy()
+
+
+def _sampled_nan_check(embeddings):
+    """Every VISION_NAN_CHECK_EVERY batches, look for NaN in a small corner of the
+    output. Keeps NaN visible in metrics without a full reduction on every batch."""
+    global _nan_checks
+    _nan_checks += 1
+    if VISION_NAN_CHECK_EVERY <= 0 or _nan_checks % VISION_NAN_CHECK_EVERY:
+        return False
+    if not torch.isnan(embeddings[:, :4, :4]).any():
+        return False
+    NAN_BATCHES.inc()
+    log(f"WARNING: NaN detected in sampled embeddings (batch of {embeddings.shape[0]}); replaced with 0.0 (degraded).")
+    return True
+
+
+def _encode_page(vecs):
+    """Encode one page's (num_vectors, dim) float32 array for the wire."""
+    return common.encode_page(vecs, VISION_EMBEDDING_ENCODING)
+
+
+def _image_key(img):
+    """Content hash of a decoded RGB image (dimensions + raw pixels)."""
+    digest = hashlib.sha256(f"{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def _shape_batches(items):
+    """Group (index, image) pairs into sub-batches of similar shape.
+
+    Images are bucketed by 64px size class and sorted by area, so each batch
+    pads little and MPS sees a small, stable set of input shapes (every new
+    shape grows its graph cache). Batches hold at most VISION_MAX_BATCH images.
+    """
+    buckets = collections.defaultdict(list)
+    for i, img in items:
+        buckets[(img.width // 64, img.height // 64)].append((i, img))
+    for bucket in buckets.values():
+        bucket.sort(key=lambda item: item[1].width * item[1].height)
+        for start in range(0, len(bucket), VISION_MAX_BATCH):
+            yield bucket[start:start + VISION_MAX_BATCH]
+
+
 def embed_images(paths):
     """Embed a list of image file paths. Returns list of multi-vector embeddings."""
     images = []
@@ -130,110 +429,107 @@ def embed_images(paths):
         img = Image.open(p).convert("RGB")
         images.append(img)
 
-    batch = processor.process_images(images).to(model.device)
-    # Cast to model dtype
-    for k, v in batch.items():
-        if isinstance(v, torch.Tensor) and v.is_floating_point():
-            batch[k] = v.to(dtype)
+    return _embed_pil_images(images)
+
 
-    embeddings = _run_image_embedding(batch)
+def embed_images_stream(paths, emit_page):
+    """embed_images, sending each page as soon as its batch is done.
+
+    emit_page gets {"index", "embedding", "num_vectors"} per page (in order
+    here, but clients place pages by index). Returns {"num_vectors"}.
+    """
+    num_vectors = []
+    for start in range(0, len(paths), VISION_MAX_BATCH):
+        images = [Image.open(p).convert("RGB") for p in paths[start:start + VISION_MAX_BATCH]]
+        result = _embed_pil_images(images)
+        for offset, (embedding, count) in enumerate(zip(result["embeddings"], result["num_vectors"])):
+            emit_page({"index": start + offset, "embedding": embedding, "num_vectors": count})
+        num_vectors.extend(result["num_vectors"])
+    return {"num_vectors": num_vectors}
+
+
+def _embed_pil_images(images):
+    """Embed decoded RGB images; shared by embed_images and extract_and_embed."""
+    keys = [_image_key(img) for img in images]
+    vectors = [cache_get(VISION_CACHE, key) for key in keys]
+    misses = [(i, images[i]) for i, vecs in enumerate(vectors) if vecs is None]
+    VISION_CACHE_HITS.inc(len(images) - len(misses))
+
+    for sub_batch in _shape_batches(misses):
+        indices = [i for i, _ in sub_batch]
+        batch = _to_model(processor.process_images([img for _, img in sub_batch]))
 
-    # Detect NaN — MPS can produce transient NaN on certain inputs
-    if torch.isnan(embeddings).any():
-        log(f"WARNING: NaN detected in embeddings for {len(paths)} image(s). Retrying...")
         embeddings = _run_image_embedding(batch)
+        # MPS can produce transient NaN on certain inputs; zero it in one fused pass
+        degraded = _sampled_nan_check(embeddings)
+        embeddings = torch.nan_to_num(embeddings, nan=0.0, posinf=0.0, neginf=0.0)
 
-        if torch.isnan(embeddings).any():
-            nan_pages = [i for i in range(embeddings.shape[0]) if torch.isnan(embeddings[i]).any()]
-            log(f"WARNING: NaN persists after retry for page indices {nan_pages}. Replacing NaN with 0.0 (degraded).")
-            embeddings = torch.nan_to_num(embeddings, nan=0.0)
+        host = _to_numpy(embeddings)
+        mask = batch["attention_mask"].bool().cpu().numpy()
+        for j, i in enumerate(indices):
+            # Drop padding positions so each page keeps only its own vectors
+            vectors[i] = host[j][mask[j]]
+            # Never cache output known to be degraded — a later request gets a fresh attempt
+            if not degraded:
+                cache_put(VISION_CACHE, keys[i], vectors[i], VISION_CACHE_MAX)
 
-    results = []
-    num_vectors = []
-    for i in range(embeddings.shape[0]):
-        vecs = embeddings[i].cpu().float().numpy().tolist()
-        results.append(vecs)
-        num_vectors.append(len(vecs))
+    num_vectors = [len(vecs) for vecs in vectors]
 
-    return {"embeddings": results, "num_vectors": num_vectors}
+    return {"embeddings": [_encode_page(vecs) for vecs in vectors], "num_vectors": num_vectors}
 
 
 def embed_queries(texts):
     """Embed query texts. Returns list of multi-vector embeddings."""
-    batch = processor.process_queries(texts).to(model.device)
-    for k, v in batch.items():
-        if isinstance(v, torch.Tensor) and v.is_floating_point():
-            batch[k] = v.to(dtype)
+    keys = [hashlib.blake2b(text.encode()).digest() for text in texts]
+    results = [cache_get(_QUERY_EMB_CACHE, key) for key in keys]
+    misses = [i for i, vecs in enumerate(results) if vecs is None]
+    QUERY_CACHE_HITS.inc(len(texts) - len(misses))
 
-    with torch.no_grad():
-        embeddings = model(**batch)
+    if misses:
+        batch = _to_model(_tokenize_queries([texts[i] for i in misses]))
 
-    results = []
-    for i in range(embeddings.shape[0]):
-        vecs = embeddings[i].cpu().float().numpy().tolist()
-        results.append(vecs)
+        with torch.inference_mode():
+            embeddings = torch.nan_to_num(model(**batch), nan=0.0, posinf=0.0, neginf=0.0)
+
+        host = _to_numpy(embeddings)
+        mask = batch["attention_mask"].bool().cpu().numpy()
+        for j, i in enumerate(misses):
+            # Keep only the query's own tokens, so a cached entry does not
+            # carry the padding of whichever batch it first ran in
+            results[i] = host[j][mask[j]]
+            cache_put(_QUERY_EMB_CACHE, keys[i], results[i], VISION_QUERY_CACHE_MAX)
 
     return {"embeddings": results}
 
 
-def extract_pages(pdf_path, output_dir):
-    """Extract page images from a PDF using PyMuPDF.
-    Returns list of output image paths and page count."""
-    os.makedirs(output_dir, exist_ok=True)
-    doc = fitz.open(pdf_path)
+def extract_and_embed(pdf_path, output_dir=None):
+    """Rasterize and embed every page of a PDF without a PNG round trip.
+    Pages go from MuPDF's pixel buffer straight into the model; PNGs are
+    written only when output_dir is given."""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    embeddings = []
+    num_vectors = []
     paths = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        # Render at 2x for quality (144 DPI)
-        pix = page.get_pixmap(dpi=144)
-        img_path = os.path.join(output_dir, f"page_{page_num:04d}.png")
-        pix.save(img_path)
-        paths.append(img_path)
-    doc.close()
-    return {"paths": paths, "page_count": len(paths)}
-
-
-def extract_text(pdf_path):
-    """Extract text content from each page of a PDF using PyMuPDF.
-    For pages with no embedded text (image-only), attempts OCR via pytesseract if available.
-    Returns list of { page_number, text, method } objects."""
-    doc = fitz.open(pdf_path)
-    pages = []
-    has_tesseract = False
-    try:
-        import pytesseract
-        has_tesseract = True
-    except ImportError:
-        pass
-
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text().strip()
-        method = "pymupdf"
-
-        if not text and has_tesseract:
-            # OCR fallback for image-only pages
-            try:
-                pix = page.get_pixmap(dpi=300)
-                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-                text = pytesseract.image_to_string(img).strip()
-                method = "tesseract"
-            except Exception as e:
-                log(f"OCR failed on page {page_num}: {e}")
-                method = "ocr_failed"
-
-        pages.append({
-            "page_number": page_num,
-            "text": text,
-            "method": method,
-        })
-
-    doc.close()
-    return {"pages": pages, "has_tesseract": has_tesseract}
-
-
-def handle_request(req):
-    """Route a JSON-RPC request to the appropriate handler."""
+    pages = common.rendered_pages(pdf_path, target_pixels=TARGET_PIXELS, output_dir=output_dir)
+    for chunk in common.batched(pages, VISION_MAX_BATCH):
+        images = [Image.frombytes("RGB", (w, h), samples) for w, h, samples, _ in chunk]
+        result = _embed_pil_images(images)
+        embeddings.extend(result["embeddings"])
+        num_vectors.extend(result["num_vectors"])
+        paths.extend(img_path for _, _, _, img_path in chunk if img_path)
+    return {
+        "embeddings": embeddings,
+        "num_vectors": num_vectors,
+        "page_count": len(embeddings),
+        "paths": paths,
+    }
+
+
+def handle_request(req, emit=None):
+    """Route a JSON-RPC request to the appropriate handler. Streaming methods
+    send partial messages through emit (default: straight to stdout)."""
+    emit = emit or write_message
     method = req.get("method")
     params = req.get("params", {})
     req_id = req.get("id")
@@ -246,31 +542,54 @@ def handle_request(req):
                 "model": MODEL_ID,
                 "device": str(device),
                 "dtype": str(dtype),
+                "quant": VISION_QUANT,
+                "protocol": PROTOCOL_VERSION,
+                "encoding": VISION_EMBEDDING_ENCODING,
             },
         }
     elif method == "embed_images":
         EMBED_REQUESTS.labels(method="embed_images").inc()
         PAGES_PROCESSED.inc(len(params["paths"]))
-        with EMBED_DURATION.labels(method="embed_images").time():
+        BATCH_SIZE.observe(len(params["paths"]))
+        with IMAGE_DURATION.labels(method="embed_images").time():
             result = embed_images(params["paths"])
+        EMBED_VECTORS.inc(sum(result["num_vectors"]))
+        return {"id": req_id, "result": result}
+    elif method == "embed_images_stream":
+        EMBED_REQUESTS.labels(method="embed_images_stream").inc()
+        PAGES_PROCESSED.inc(len(params["paths"]))
+        BATCH_SIZE.observe(len(params["paths"]))
+        with IMAGE_DURATION.labels(method="embed_images_stream").time():
+            result = embed_images_stream(params["paths"], lambda page: emit({"id": req_id, "partial": page}))
+        EMBED_VECTORS.inc(sum(result["num_vectors"]))
         return {"id": req_id, "result": result}
     elif method == "embed_query":
         EMBED_REQUESTS.labels(method="embed_query").inc()
-        with EMBED_DURATION.labels(method="embed_query").time():
+        with QUERY_DURATION.labels(method="embed_query").time():
             result = embed_queries([params["text"]])
         return {"id": req_id, "result": {"embedding": result["embeddings"][0]}}
     elif method == "embed_queries":
         EMBED_REQUESTS.labels(method="embed_queries").inc()
-        with EMBED_DURATION.labels(method="embed_queries").time():
+        with QUERY_DURATION.labels(method="embed_queries").time():
             result = embed_queries(params["texts"])
         return {"id": req_id, "result": result}
     elif method == "extract_pages":
         EMBED_REQUESTS.labels(method="extract_pages").inc()
         with EMBED_DURATION.labels(method="extract_pages").time():
-            result = extract_pages(params["pdf_path"], params["output_dir"])
+            result = common.extract_pages(
+                params["pdf_path"], params["output_dir"], target_pixels=TARGET_PIXELS
+            )
+        return {"id": req_id, "result": result}
+    elif method == "extract_and_embed":
+        EMBED_REQUESTS.labels(method="extract_and_embed").inc()
+        with IMAGE_DURATION.labels(method="extract_and_embed").time():
+            result = extract_and_embed(params["pdf_path"], params.get("output_dir"))
+        PAGES_PROCESSED.inc(result["page_count"])
+        BATCH_SIZE.observe(result["page_count"])
+        EMBED_VECTORS.inc(sum(result["num_vectors"]))
         return {"id": req_id, "result": result}
     elif method == "extract_text":
-        result = extract_text(params["pdf_path"])
+        result = common.extract_text(params["pdf_path"])
         return {"id": req_id, "result": result}
     elif method == "shutdown":
         return {"id": req_id, "result": {"status": "shutting_down"}}
@@ -278,47 +597,29 @@ def handle_request(req):
         return {"id": req_id, "error": f"Unknown method: {method}"}
 
 
-def safe_json_dumps(obj):
-    """Serialize to JSON, replacing any NaN/Infinity with null.
-    Python's json.dumps emits invalid JSON tokens (NaN, Infinity) by default."""
-    try:
-        return json.dumps(obj, allow_nan=False)
-    except ValueError:
-        # Fallback: sanitize floats manually
-        log("WARNING: Response contained NaN/Infinity — sanitizing for valid JSON.")
-        def sanitize(o):
-            if isinstance(o, float) and (math.isnan(o) or math.isinf(o)):
-                return None
-            if isinstance(o, dict):
-                return {k: sanitize(v) for k, v in o.items()}
-            if isinstance(o, list):
-                return [sanitize(v) for v in o]
-            return o
-        return json.dumps(sanitize(obj))
-
-
 def main():
     log("Initializing vision server...")
     start_metrics_server()
     init_model()
 
     # Signal readiness
-    ready_msg = json.dumps({"ready": True, "model": MODEL_ID, "device": str(device)})
-    sys.stdout.write(ready_msg + "\n")
-    sys.stdout.flush()
+    write_message({"ready": True, "model": MODEL_ID, "device": str(device), "protocol": PROTOCOL_VERSION})
 
     log("Ready. Waiting for requests on stdin...")
 
-    for line in sys.stdin:
-        line = line.strip()
+    stdin = sys.stdin.buffer
+    while True:
+        line = stdin.readline()
         if not line:
+            break
+        line = line.rstrip(b"\r\n")
+        if not line.strip():
             continue
+        req = None
         try:
-            req = json.loads(line)
+            req = orjson.loads(line)
             if req.get("method") == "shutdown":
-                response = handle_request(req)
-                sys.stdout.write(safe_json_dumps(response) + "\n")
-                sys.stdout.flush()
+                write_message(handle_request(req))
                 log("Shutdown requested. Exiting.")
                 break
 
@@ -330,8 +631,9 @@ def main():
                 "error": str(e),
             }
 
-        sys.stdout.write(safe_json_dumps(response) + "\n")
-        sys.stdout.flush()
+        write_message(response)
+
+    common.shutdown_render_pool()
 
 
 if __name__ == "__main__":
@@ -8,24 +8,44 @@ Same JSON-RPC protocol, same request/response format.
 Uses:
   - mlx-embeddings for the ColQwen2.5 model
   - mlx-vlm's Qwen2.5-VL backbone
-  - transformers' Qwen2VLImageProcessor for image preprocessing
+  - preproc.py for Qwen2-VL image preprocessing (Numba-fused normalize)
+  - common.py for PDF rendering, text extraction and JSON-RPC output (shared with server.py)
+
+Embeddings leave the model as float16 and are never upcast here; a client
+that scores in float32 widens them once on ingest. VISION_EMBEDDING_ENCODING:
+"float16" (default here) packs each page and query as base64 float16
+{"dtype", "shape", "data"}; "int8" packs pages as in server.py; "json" sends
+nested lists (widened to float32 for orjson). Encoders live in common.py.
+
+embed_images_stream sends one {"id", "partial": {"index", "embedding",
+"num_vectors"}} line per page as batches finish, then {"id", "result":
+{"num_vectors"}}.
 """
 
-import json
+import collections
+import hashlib
+import math
 import os
+import queue
 import sys
+import threading
 import time
 import traceback
 
 import mlx.core as mx
 import numpy as np
-import fitz  # PyMuPDF
+import orjson
 from PIL import Image
-from transformers import Qwen2VLImageProcessor, AutoTokenizer
+from transformers import AutoTokenizer
+
+import common
+import preproc
+from common import cache_get, cache_put, log, write_message
+
+common.LOG_NAME = "vision-server-mlx"
 
 # Globals — set on init
 model = None
-image_processor = None
 tokenizer = None
 MODEL_ID = "qnguyen3/colqwen2.5-v0.2-mlx"
 BACKEND = "mlx"
@@ -40,31 +60,108 @@ QUERY_AUGMENTATION_COUNT = 10
 # colpali_engine uses max_pixels=602112 to constrain image resolution
 COLPALI_MAX_PIXELS = 602112
 COLPALI_MIN_PIXELS = 3136
+# VISUAL_PROMPT_PREFIX token ids either side of <|image_pad|>, set in init_model
+PROMPT_LEFT = None
+PROMPT_RIGHT = None
+# Host staging buffer for padded input ids and masks (see _left_pad)
+_pad_scratch = np.empty(0, dtype=np.int32)
+
+# Wire format for embeddings (same knob as server.py; float16 is the model's
+# native precision here, so it is the default)
+EMBEDDING_ENCODINGS = ("float16", "int8", "json")
+VISION_EMBEDDING_ENCODING = os.environ.get("VISION_EMBEDDING_ENCODING", "float16").lower()
+PROTOCOL_VERSION = 2
+
+# MLX arrays are immutable, so buffers cannot be reused by writing into them;
+# instead the allocator keeps freed Metal buffers in a cache and hands them
+# back out for later requests. VISION_MLX_CACHE_MB caps that cache (unset keeps
+# MLX's default, which allows up to the memory limit).
+VISION_MLX_CACHE_MB = os.environ.get("VISION_MLX_CACHE_MB")
+
+# Max uncached queries per forward pass in embed_queries
+QUERY_BATCH = 32
+
+# Weight precision (same knob as server.py). "auto" keeps the checkpoint's
+# float16 weights; "4bit" quantizes linear layers after load, leaving the
+# 128-dim embedding projection in float16.
+VISION_QUANT = os.environ.get("VISION_QUANT", "auto").lower()
+QUANT_GROUP_SIZE = 64
+
+# LRU of query embeddings keyed by a hash of the query text (same knob as server.py)
+VISION_QUERY_CACHE_MAX = int(os.environ.get("VISION_QUERY_CACHE_MAX", "256"))
+_QUERY_EMB_CACHE = collections.OrderedDict()
+
+# Max page images per forward pass (same knob as server.py). Rows are
+# left-padded to the longest prompt in the batch.
+VISION_MAX_BATCH = max(1, int(os.environ.get("VISION_MAX_BATCH", "8")))
+# Largest/smallest patch-count ratio allowed within one image batch
+IMAGE_BUCKET_RATIO = 1.25
+
+# Warmup compiles kernels for a US Letter page rendered at COLPALI_MAX_PIXELS
+# (common.WARMUP_PAGE_RECT), the shape real PDF pages arrive in
+VISION_SKIP_WARMUP = os.environ.get("VISION_SKIP_WARMUP", "0") == "1"
 
 
 def init_model():
     """Load ColQwen2.5 on MLX (Apple Metal GPU)."""
-    global model, image_processor, tokenizer
+    global model, tokenizer, VISION_EMBEDDING_ENCODING
 
     log(f"Loading {MODEL_ID} on MLX...")
 
+    if VISION_EMBEDDING_ENCODING not in EMBEDDING_ENCODINGS:
+        log(f"WARNING: Unknown VISION_EMBEDDING_ENCODING={VISION_EMBEDDING_ENCODING!r}; using float16.")
+        VISION_EMBEDDING_ENCODING = "float16"
+
+    if VISION_MLX_CACHE_MB:
+        # mx.set_cache_limit moved out of mx.metal in newer MLX releases
+        set_cache_limit = getattr(mx, "set_cache_limit", None) or mx.metal.set_cache_limit
+        set_cache_limit(int(VISION_MLX_CACHE_MB) * 1024 * 1024)
+        log(f"MLX buffer cache limited to {VISION_MLX_CACHE_MB} MB")
+
     from mlx_embeddings.utils import load
 
     model, tokenizer = load(MODEL_ID)
+    if VISION_QUANT == "4bit":
+        _quantize_4bit()
+    elif VISION_QUANT != "auto":
+        log(f"WARNING: VISION_QUANT={VISION_QUANT!r} is not supported on MLX; using float16.")
+    # MLX loads weights lazily; materialize them now instead of on the first request
+    mx.eval(model.parameters())
+    _init_image_prompt()
 
-    # Load the Qwen2.5-VL image processor with colpali's resolution constraints
-    image_processor = Qwen2VLImageProcessor.from_pretrained(
-        "Qwen/Qwen2.5-VL-3B-Instruct",
-        max_pixels=COLPALI_MAX_PIXELS,
-        min_pixels=COLPALI_MIN_PIXELS,
-    )
+    # Compile the image normalize kernel now rather than on the first page
+    preproc.warmup()
+
+    log(f"Model loaded. Backend={BACKEND}, device=gpu, quant={VISION_QUANT}")
+
+    if VISION_SKIP_WARMUP:
+        log("Skipping warmup (VISION_SKIP_WARMUP=1).")
+    else:
+        _warmup()
+
+
+def _quantize_4bit():
+    """Quantize linear/embedding layers to 4-bit in place, skipping the projection head."""
+    import mlx.nn as nn
 
-    log(f"Model loaded. Backend={BACKEND}, device=gpu")
+    def should_quantize(path, module):
+        if path.startswith("embedding_proj_layer") or not hasattr(module, "to_quantized"):
+            return False
+        return module.weight.shape[-1] % QUANT_GROUP_SIZE == 0
 
+    nn.quantize(model, group_size=QUANT_GROUP_SIZE, bits=4, class_predicate=should_quantize)
+    log(f"Quantized weights to 4-bit (group_size={QUANT_GROUP_SIZE}).")
 
-def log(msg):
-    """Log to stderr (stdout is reserved for JSON-RPC)."""
-    print(f"[vision-server-mlx] {msg}", file=sys.stderr, flush=True)
+
+def _warmup():
+    """Run one query and one page through the model before signalling ready,
+    so the first real request does not pay for Metal kernel compilation."""
+    log("Warming up...")
+    query = tokenizer("warmup" + QUERY_AUGMENTATION_TOKEN * QUERY_AUGMENTATION_COUNT, return_tensors="np")
+    _forward(mx.array(query["input_ids"]), attention_mask=mx.array(query["attention_mask"]))
+    page = Image.new("RGB", common.rendered_size(common.WARMUP_PAGE_RECT, COLPALI_MAX_PIXELS), "white")
+    _embed_images([page])
+    log("Warmup complete.")
 
 
 def _compute_position_ids(input_ids, image_grid_thw=None, attention_mask=None):
@@ -76,10 +173,61 @@ def _compute_position_ids(input_ids, image_grid_thw=None, attention_mask=None):
     )
 
 
-def _forward(input_ids, pixel_values=None, image_grid_thw=None, attention_mask=None):
-    """Run the full ColQwen2.5 forward pass and return L2-normalized embeddings."""
+def _attention_bias(attention_mask, dtype):
+    """Additive (batch, 1, L, L) causal mask that also hides padded keys.
+
+    The diagonal stays open so padding rows always see one key and softmax
+    never produces NaN; their outputs are dropped afterwards anyway.
+    """
+    length = attention_mask.shape[1]
+    positions = mx.arange(length)
+    causal = positions[None, :] <= positions[:, None]
+    keep = (causal[None] & (attention_mask[:, None, :] > 0)) | mx.eye(length, dtype=mx.bool_)[None]
+    return mx.where(keep[:, None], 0.0, float("-inf")).astype(dtype)
+
+
+def _left_pad(rows):
+    """Left-pad token id rows into (input_ids, attention_mask) arrays.
+
+    Both are staged in one grow-only host buffer reused across batches;
+    mx.array copies out of it, so the next batch can overwrite it.
+    """
+    global _pad_scratch
+    width = max(len(row) for row in rows)
+    size = len(rows) * width
+    if _pad_scratch.size < 2 * size:
+        _pad_scratch = np.empty(2 * size, dtype=np.int32)
+    input_ids = _pad_scratch[:size].reshape(len(rows), width)
+    attention_mask = _pad_scratch[size:2 * size].reshape(len(rows), width)
+    input_ids.fill(tokenizer.pad_token_id or 0)
+    attention_mask.fill(0)
+    for i, row in enumerate(rows):
+        input_ids[i, width - len(row):] = row
+        attention_mask[i, width - len(row):] = 1
+    return mx.array(input_ids), mx.array(attention_mask)
+
+
+def _project(hidden, attention_mask):
+    """Project hidden states to the embedding dim (128), L2 normalize, and
+    zero out padding positions."""
     from mlx_embeddings.models.base import normalize_embeddings
 
+    return normalize_embeddings(model.embedding_proj_layer(hidden)) * attention_mask[:, :, None]
+
+
+# The projection tail is pure array math, so MLX fuses the projection,
+# normalize and mask multiply into a few kernels; shapeless keeps one trace
+# across sequence lengths. The rest of the forward (rope index, image merge)
+# has data-dependent Python control flow and stays eager.
+_project_compiled = mx.compile(_project, shapeless=True)
+
+
+def _forward(input_ids, pixel_values=None, image_grid_thw=None, attention_mask=None, evaluate=True):
+    """Run the full ColQwen2.5 forward pass and return L2-normalized embeddings.
+
+    With evaluate=False the result stays lazy, so a caller building several
+    batches can mx.eval them together.
+    """
     # Compute position IDs
     position_ids, _ = _compute_position_ids(
         input_ids, image_grid_thw=image_grid_thw, attention_mask=attention_mask
@@ -90,74 +238,156 @@ def _forward(input_ids, pixel_values=None, image_grid_thw=None, attention_mask=N
         input_ids, pixel_values, image_grid_thw
     )
 
-    # Language model forward pass
+    # Language model forward pass. Left-padded batches need their own mask so
+    # real tokens never attend to the padding in front of them.
+    mask = None
+    if attention_mask is not None and (attention_mask == 0).any().item():
+        mask = _attention_bias(attention_mask, inputs_embeds.dtype)
     output_hidden = model.vlm.language_model.model(
-        None, inputs_embeds=inputs_embeds, position_ids=position_ids
+        None, inputs_embeds=inputs_embeds, position_ids=position_ids, mask=mask
     )
 
-    # Project to embedding dim (128) and L2 normalize
-    embeddings = model.embedding_proj_layer(output_hidden)
-    embeddings = normalize_embeddings(embeddings)
-
-    # Apply attention mask if provided (zero out padding positions)
-    if attention_mask is not None:
-        embeddings = embeddings * attention_mask[:, :, None]
+    # Project, normalize and mask in one compiled graph (all-ones mask when unpadded)
+    if attention_mask is None:
+        attention_mask = mx.ones(input_ids.shape, dtype=mx.int32)
+    embeddings = _project_compiled(output_hidden, attention_mask)
 
-    # Force evaluation
-    mx.eval(embeddings)
+    if evaluate:
+        mx.eval(embeddings)
 
     return embeddings
 
 
+def _init_image_prompt():
+    """Tokenize VISUAL_PROMPT_PREFIX once and split it around <|image_pad|>."""
+    global PROMPT_LEFT, PROMPT_RIGHT
+    # The tokenizer converts the placeholder to the model's image token id
+    prefix_tokens = np.array(tokenizer.encode(VISUAL_PROMPT_PREFIX, add_special_tokens=False), dtype=np.int32)
+    pos = int(np.flatnonzero(prefix_tokens == model.image_token_id)[0])
+    PROMPT_LEFT, PROMPT_RIGHT = prefix_tokens[:pos], prefix_tokens[pos + 1:]
+
+
+def _image_prompt(grid_thw):
+    """Visual prompt token ids with <|image_pad|> expanded for one image grid."""
+    # Count how many image tokens the processor expects
+    t_val, h_val, w_val = grid_thw
+    merge_size = 2  # Qwen2.5-VL spatial_merge_size
+    n_image_tokens = int((h_val // merge_size) * (w_val // merge_size) * t_val)
+    image_tokens = np.full(n_image_tokens, model.image_token_id, dtype=np.int32)
+    return np.concatenate((PROMPT_LEFT, image_tokens, PROMPT_RIGHT))
+
+
+def _encode_page(vecs):
+    """Encode one page's (num_vectors, dim) float16 array for the wire."""
+    return common.encode_page(vecs, VISION_EMBEDDING_ENCODING)
+
+
+def _encode_query(vecs):
+    """Encode one query's (num_vectors, dim) float16 array for the wire."""
+    return common.encode_query(vecs, VISION_EMBEDDING_ENCODING)
+
+
+def _preprocess(img):
+    """RGB image -> (float16 patches, grid_thw)."""
+    # Process image with constrained resolution (matching colpali_engine),
+    # emitting float16 (the vision tower's dtype) so MLX never casts it
+    return preproc.preprocess(img, COLPALI_MIN_PIXELS, COLPALI_MAX_PIXELS, dtype=np.float16)
+
+
+def _area_buckets(grids):
+    """Group image indices into batches of similar grid area.
+
+    Indices are sorted by patch count and a batch closes once an image
+    exceeds IMAGE_BUCKET_RATIO x the batch's smallest area (or the batch
+    holds VISION_MAX_BATCH images), so left padding stays small.
+    """
+    order = sorted(range(len(grids)), key=lambda i: math.prod(grids[i]))
+    batch = []
+    for i in order:
+        if batch and (
+            len(batch) == VISION_MAX_BATCH
+            or math.prod(grids[i]) > IMAGE_BUCKET_RATIO * math.prod(grids[batch[0]])
+        ):
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def _embed_image_batch(prepared):
+    """Embed preprocessed (patches, grid_thw) pairs in one forward pass.
+    Returns one (num_vectors, dim) host array per image."""
+    grids = [grid_thw for _, grid_thw in prepared]
+    prompts = [_image_prompt(grid_thw) for grid_thw in grids]
+    input_ids, attention_mask = _left_pad(prompts)
+
+    embeddings = _forward(
+        input_ids,
+        pixel_values=mx.array(np.concatenate([patches for patches, _ in prepared])),
+        image_grid_thw=mx.array(grids),
+        attention_mask=attention_mask,
+    )
+
+    # One host copy for the batch; each row keeps only its own (right-aligned) positions
+    host = np.array(embeddings.astype(mx.float16))
+    width = host.shape[1]
+    return [host[i, width - len(prompt):] for i, prompt in enumerate(prompts)]
+
+
+def _embed_images(images):
+    """Embed RGB images, batching by grid area. Results keep input order."""
+    return _embed_prepared([_preprocess(img) for img in images])
+
+
+def _embed_prepared(prepared):
+    """Embed preprocessed (patches, grid_thw) pairs, batching by grid area."""
+    vectors = [None] * len(prepared)
+    for batch in _area_buckets([grid_thw for _, grid_thw in prepared]):
+        for i, vecs in zip(batch, _embed_image_batch([prepared[i] for i in batch])):
+            vectors[i] = vecs
+    return vectors
+
+
 def embed_images(paths):
     """Embed a list of image file paths. Returns list of multi-vector embeddings.
 
     Matches colpali_engine's ColQwen2_5_Processor.process_images() behavior:
     - Uses VISUAL_PROMPT_PREFIX to wrap image tokens with context
     - Constrains resolution via max_pixels=602112
+    Images are batched by similar size, up to VISION_MAX_BATCH per forward.
     """
-    all_embeddings = []
-    num_vectors = []
-
-    for p in paths:
-        img = Image.open(p).convert("RGB")
-
-        # Process image with constrained resolution (matching colpali_engine)
-        img_inputs = image_processor(images=[img], return_tensors="np")
-        pixel_values = mx.array(img_inputs["pixel_values"])
-        image_grid_thw = mx.array(img_inputs["image_grid_thw"])
-
-        # Tokenize the visual prompt prefix (contains <|image_pad|> placeholder)
-        # The tokenizer converts this to the right token IDs including the image token
-        prefix_tokens = tokenizer.encode(VISUAL_PROMPT_PREFIX, add_special_tokens=False)
-        image_token_id = model.image_token_id
-
-        # Count how many image tokens the processor expects
-        t_val, h_val, w_val = image_grid_thw[0].tolist()
-        merge_size = 2  # Qwen2.5-VL spatial_merge_size
-        n_image_tokens = int((h_val // merge_size) * (w_val // merge_size) * t_val)
-
-        # Replace the single <|image_pad|> token in prefix with n_image_tokens
-        expanded = []
-        for tid in prefix_tokens:
-            if tid == image_token_id:
-                expanded.extend([image_token_id] * n_image_tokens)
-            else:
-                expanded.append(tid)
-
-        input_ids = mx.array([expanded])
-
-        # Forward pass
-        embeddings = _forward(
-            input_ids, pixel_values=pixel_values, image_grid_thw=image_grid_thw
-        )
+    # Files decode straight to the processor's target size (see preproc.load_and_preprocess)
+    all_embeddings = _embed_prepared([
+        preproc.load_and_preprocess(p, COLPALI_MIN_PIXELS, COLPALI_MAX_PIXELS, dtype=np.float16)
+        for p in paths
+    ])
+
+    num_vectors = [len(vecs) for vecs in all_embeddings]
+    return {"embeddings": [_encode_page(vecs) for vecs in all_embeddings], "num_vectors": num_vectors}
 
-        # Convert to nested lists (float32)
-        vecs = np.array(embeddings[0].astype(mx.float32)).tolist()
-        all_embeddings.append(vecs)
-        num_vectors.append(len(vecs))
 
-    return {"embeddings": all_embeddings, "num_vectors": num_vectors}
+def embed_images_stream(paths, emit_page):
+    """embed_images, sending each page as soon as its batch is done.
+
+    emit_page gets {"index", "embedding", "num_vectors"} per page. Batches
+    follow grid area, so pages arrive out of order; clients place them by
+    index. Batches are planned from file headers, and each batch's images
+    are decoded only when it runs, so the first page goes out after one
+    batch rather than after every image is preprocessed. Returns
+    {"num_vectors"}.
+    """
+    grids = [preproc.file_grid(p, COLPALI_MIN_PIXELS, COLPALI_MAX_PIXELS) for p in paths]
+    num_vectors = [0] * len(paths)
+    for batch in _area_buckets(grids):
+        prepared = [
+            preproc.load_and_preprocess(paths[i], COLPALI_MIN_PIXELS, COLPALI_MAX_PIXELS, dtype=np.float16)
+            for i in batch
+        ]
+        for i, vecs in zip(batch, _embed_image_batch(prepared)):
+            num_vectors[i] = len(vecs)
+            emit_page({"index": i, "embedding": _encode_page(vecs), "num_vectors": len(vecs)})
+    return {"num_vectors": num_vectors}
 
 
 def embed_queries(texts):
@@ -165,94 +395,66 @@ def embed_queries(texts):
 
     Matches colpali_engine's ColQwen2_5_Processor.process_queries() behavior:
     - Appends 10x <|endoftext|> tokens as query augmentation
-    - No padding beyond that
+    - Each query keeps only its own tokens (padding is stripped)
+    Uncached queries are sorted by token length and run QUERY_BATCH at a
+    time, so each batch pads only to its own longest query.
     """
-    results = []
-
-    for text in texts:
-        # Add query augmentation suffix (10x <|endoftext|>)
-        augmented = text + (QUERY_AUGMENTATION_TOKEN * QUERY_AUGMENTATION_COUNT)
-
-        # Tokenize without extra padding
-        inputs = tokenizer(
-            augmented,
-            return_tensors="np",
-            padding=False,
-            truncation=True,
-        )
-        input_ids = mx.array(inputs["input_ids"])
-        attention_mask = mx.array(inputs["attention_mask"])
-
-        # Forward pass (text-only, no pixel_values)
-        embeddings = _forward(
-            input_ids, attention_mask=attention_mask
-        )
-
-        # All positions are active (no padding)
-        vecs = np.array(embeddings[0].astype(mx.float32)).tolist()
-        results.append(vecs)
+    keys = [hashlib.blake2b(text.encode()).digest() for text in texts]
+    results = [cache_get(_QUERY_EMB_CACHE, key) for key in keys]
+    misses = [i for i, vecs in enumerate(results) if vecs is None]
+    if not misses:
+        return {"embeddings": results}
+
+    # Add query augmentation suffix (10x <|endoftext|>) and tokenize without padding
+    augmented = [texts[i] + (QUERY_AUGMENTATION_TOKEN * QUERY_AUGMENTATION_COUNT) for i in misses]
+    token_rows = tokenizer(augmented, padding=False, truncation=True)["input_ids"]
+    order = sorted(range(len(misses)), key=lambda j: len(token_rows[j]))
+
+    # Forward passes (text-only, no pixel_values) stay lazy and are evaluated
+    # together, so MLX schedules every batch in one go
+    batches = [order[start:start + QUERY_BATCH] for start in range(0, len(order), QUERY_BATCH)]
+    outputs = []
+    for batch in batches:
+        input_ids, attention_mask = _left_pad([token_rows[j] for j in batch])
+        outputs.append(_forward(input_ids, attention_mask=attention_mask, evaluate=False).astype(mx.float16))
+    mx.eval(outputs)
+
+    for batch, embeddings in zip(batches, outputs):
+        host = np.array(embeddings)
+        width = host.shape[1]
+        for row, j in enumerate(batch):
+            i = misses[j]
+            results[i] = _encode_query(host[row, width - len(token_rows[j]):])
+            cache_put(_QUERY_EMB_CACHE, keys[i], results[i], VISION_QUERY_CACHE_MAX)
 
     return {"embeddings": results}
 
 
-def extract_pages(pdf_path, output_dir):
-    """Extract page images from a PDF using PyMuPDF.
-    Returns list of output image paths and page count."""
-    os.makedirs(output_dir, exist_ok=True)
-    doc = fitz.open(pdf_path)
+def extract_and_embed(pdf_path, output_dir=None):
+    """Rasterize and embed every page of a PDF without a PNG round trip.
+    Pages go from MuPDF's pixel buffer straight into the model; PNGs are
+    written only when output_dir is given."""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    vectors = []
     paths = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        # Render at 2x for quality (144 DPI)
-        pix = page.get_pixmap(dpi=144)
-        img_path = os.path.join(output_dir, f"page_{page_num:04d}.png")
-        pix.save(img_path)
-        paths.append(img_path)
-    doc.close()
-    return {"paths": paths, "page_count": len(paths)}
-
-
-def extract_text(pdf_path):
-    """Extract text content from each page of a PDF using PyMuPDF.
-    For pages with no embedded text (image-only), attempts OCR via pytesseract if available.
-    Returns list of { page_number, text, method } objects."""
-    doc = fitz.open(pdf_path)
-    pages = []
-    has_tesseract = False
-    try:
-        import pytesseract
-        has_tesseract = True
-    except ImportError:
-        pass
-
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text().strip()
-        method = "pymupdf"
-
-        if not text and has_tesseract:
-            # OCR fallback for image-only pages
-            try:
-                pix = page.get_pixmap(dpi=300)
-                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-                text = pytesseract.image_to_string(img).strip()
-                method = "tesseract"
-            except Exception as e:
-                log(f"OCR failed on page {page_num}: {e}")
-                method = "ocr_failed"
-
-        pages.append({
-            "page_number": page_num,
-            "text": text,
-            "method": method,
-        })
-
-    doc.close()
-    return {"pages": pages, "has_tesseract": has_tesseract}
-
-
-def handle_request(req):
-    """Route a JSON-RPC request to the appropriate handler."""
+    pages = common.rendered_pages(pdf_path, target_pixels=COLPALI_MAX_PIXELS, output_dir=output_dir)
+    for chunk in common.batched(pages, VISION_MAX_BATCH):
+        images = [Image.frombytes("RGB", (w, h), samples) for w, h, samples, _ in chunk]
+        vectors.extend(_embed_images(images))
+        paths.extend(img_path for _, _, _, img_path in chunk if img_path)
+    return {
+        "embeddings": [_encode_page(vecs) for vecs in vectors],
+        "num_vectors": [len(vecs) for vecs in vectors],
+        "page_count": len(vectors),
+        "paths": paths,
+    }
+
+
+def handle_request(req, emit=None):
+    """Route a JSON-RPC request to the appropriate handler. Streaming methods
+    send partial messages through emit (default: straight to stdout)."""
+    emit = emit or write_message
     method = req.get("method")
     params = req.get("params", {})
     req_id = req.get("id")
@@ -265,12 +467,18 @@ def handle_request(req):
                 "model": MODEL_ID,
                 "device": "gpu",
                 "dtype": "float16",
+                "quant": VISION_QUANT,
+                "protocol": PROTOCOL_VERSION,
+                "encoding": VISION_EMBEDDING_ENCODING,
                 "backend": BACKEND,
             },
         }
     elif method == "embed_images":
         result = embed_images(params["paths"])
         return {"id": req_id, "result": result}
+    elif method == "embed_images_stream":
+        result = embed_images_stream(params["paths"], lambda page: emit({"id": req_id, "partial": page}))
+        return {"id": req_id, "result": result}
     elif method == "embed_query":
         result = embed_queries([params["text"]])
         return {"id": req_id, "result": {"embedding": result["embeddings"][0]}}
@@ -278,10 +486,15 @@ def handle_request(req):
         result = embed_queries(params["texts"])
         return {"id": req_id, "result": result}
     elif method == "extract_pages":
-        result = extract_pages(params["pdf_path"], params["output_dir"])
+        result = common.extract_pages(
+            params["pdf_path"], params["output_dir"], target_pixels=COLPALI_MAX_PIXELS
+        )
+        return {"id": req_id, "result": result}
+    elif method == "extract_and_embed":
+        result = extract_and_embed(params["pdf_path"], params.get("output_dir"))
         return {"id": req_id, "result": result}
     elif method == "extract_text":
-        result = extract_text(params["pdf_path"])
+        result = common.extract_text(params["pdf_path"])
         return {"id": req_id, "result": result}
     elif method == "shutdown":
         return {"id": req_id, "result": {"status": "shutting_down"}}
@@ -289,31 +502,81 @@ def handle_request(req):
         return {"id": req_id, "error": f"Unknown method: {method}"}
 
 
+def _read_requests(requests):
+    """Reader thread: parse stdin lines onto the request queue.
+    Items are (request, None) or (None, parse error); None marks EOF."""
+    for line in sys.stdin.buffer:
+        line = line.rstrip(b"\r\n")
+        if not line.strip():
+            continue
+        try:
+            requests.put((orjson.loads(line), None))
+        except Exception as e:
+            requests.put((None, str(e)))
+    requests.put(None)
+
+
+def _write_responses(responses):
+    """Writer thread: serialize and write responses in order until None.
+
+    A response that fails to serialize is replaced by an error line for its
+    id, so the bridge never waits on a reply that died with this thread. If
+    even that cannot be written, stdout is unusable and the server exits.
+    """
+    while True:
+        response = responses.get()
+        if response is None:
+            break
+        try:
+            write_message(response)
+        except Exception as e:
+            log(f"Error writing response: {traceback.format_exc()}")
+            try:
+                write_message({
+                    "id": response.get("id") if isinstance(response, dict) else None,
+                    "error": f"Failed to write response: {e}",
+                })
+            except Exception:
+                log(f"Error writing error response: {traceback.format_exc()}")
+                os._exit(1)
+
+
 def main():
     log("Initializing vision server (MLX backend)...")
     init_model()
 
     # Signal readiness
-    ready_msg = json.dumps({"ready": True, "model": MODEL_ID, "device": "gpu", "backend": BACKEND})
-    sys.stdout.write(ready_msg + "\n")
-    sys.stdout.flush()
+    write_message({
+        "ready": True,
+        "model": MODEL_ID,
+        "device": "gpu",
+        "backend": BACKEND,
+        "protocol": PROTOCOL_VERSION,
+    })
 
     log("Ready. Waiting for requests on stdin...")
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
+    # Parsing and serialization run on their own threads so they overlap with
+    # model compute. The small request queue keeps backpressure on stdin; the
+    # response queue is FIFO, so replies (shutdown included) keep their order.
+    requests = queue.Queue(maxsize=4)
+    responses = queue.Queue()
+    threading.Thread(target=_read_requests, args=(requests,), daemon=True).start()
+    writer = threading.Thread(target=_write_responses, args=(responses,))
+    writer.start()
+
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        req, parse_error = item
+        if parse_error is not None:
+            log(f"Error parsing request: {parse_error}")
+            responses.put({"id": None, "error": parse_error})
             continue
+
         try:
-            req = json.loads(line)
-            if req.get("method") == "shutdown":
-                response = handle_request(req)
-                sys.stdout.write(json.dumps(response) + "\n")
-                sys.stdout.flush()
-                log("Shutdown requested. Exiting.")
-                break
-
-            response = handle_request(req)
+            response = handle_request(req, emit=responses.put)
         except Exception as e:
             log(f"Error handling request: {traceback.format_exc()}")
             response = {
@@ -321,8 +584,15 @@ def main():
                 "error": str(e),
             }
 
-        sys.stdout.write(json.dumps(response) + "\n")
-        sys.stdout.flush()
+        responses.put(response)
+        if isinstance(req, dict) and req.get("method") == "shutdown":
+            log("Shutdown requested. Exiting.")
+            break
+
+    responses.put(None)
+    writer.join()
+
+    common.shutdown_render_pool()
 
 
 if __name__ == "__main__":
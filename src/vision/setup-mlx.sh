@@ -37,6 +37,6 @@ print('Setup complete! Model weights will be downloaded on first use.')
 echo ""
 echo "=== Setup Complete ==="
 echo "To test the server manually:"
-echo "  $VENV_DIR/bin/python3 $SCRIPT_DIR/server_mlx.py"
+echo "  $VENV_DIR/bin/python3 $SCRIPT_DIR/serve.py server_mlx"
 echo ""
 echo "To use MLX backend, set: VISION_BACKEND=mlx"
@@ -37,4 +37,4 @@ print('Setup complete! Model weights will be downloaded on first use.')
 echo ""
 echo "=== Setup Complete ==="
 echo "To test the server manually:"
-echo "  $VENV_DIR/bin/python3 $SCRIPT_DIR/server.py"
+echo "  $VENV_DIR/bin/python3 $SCRIPT_DIR/serve.py server"
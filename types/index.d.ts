@@ -239,6 +239,7 @@ export function createTextAdapter(): EmbeddingAdapter & {
 
 // --- adapters/vision-adapter.mjs ---
 export function createVisionAdapter(opts?: {
+  // "torch" or "mlx"; defaults to resolveBackend()
   backend?: string;
 }): EmbeddingAdapter & {
   extractPages(
@@ -251,17 +252,47 @@ export function createVisionAdapter(opts?: {
     pages: Array<{ page_number: number; text: string; method: string }>;
     has_tesseract: boolean;
   }>;
+  extractAndEmbed(
+    pdfPath: string,
+    outputDir?: string | null
+  ): Promise<{
+    embeddings: Float32Array[][];
+    num_vectors: number[];
+    page_count: number;
+    paths: string[];
+  }>;
   embedImagesWithMeta(
     imagePaths: string[]
   ): Promise<{
     embeddings: Float32Array[][];
     num_vectors: number[];
   }>;
+  embedImagesStream(
+    imagePaths: string[],
+    onPage: (page: StreamedPage) => void
+  ): Promise<{ num_vectors: number[] }>;
   embeddingToBlob(embedding: Float32Array): Buffer;
   blobToEmbedding(blob: Buffer): Float32Array;
 };
 
 // --- vision/bridge.mjs ---
+export interface StreamedPage {
+  index: number;
+  embedding: Float32Array[];
+  num_vectors: number;
+}
+
+export type EncodedEmbedding =
+  | number[][]
+  | { dtype: "int8" | "float16" | "float32"; shape: [number, number]; data: string; scales?: string };
+
+export function decodeEmbedding(encoded: EncodedEmbedding): Float32Array[];
+// Explicit backend > VISION_BACKEND > "mlx" on darwin/arm64 when venv-mlx/ exists > "torch"
+export function resolveBackend(
+  backend?: string,
+  opts?: { platform?: string; arch?: string }
+): string;
+
 export class VisionBridge {
   constructor(opts?: { backend?: string });
   backend: string;
@@ -283,12 +314,25 @@ export class VisionBridge {
     embeddings: Float32Array[][];
     num_vectors: number[];
   }>;
+  embedImagesStream(
+    paths: string[],
+    onPage: (page: StreamedPage) => void
+  ): Promise<{ num_vectors: number[] }>;
   embedQuery(text: string): Promise<Float32Array[]>;
   embedQueries(texts: string[]): Promise<Float32Array[][]>;
   extractPages(
     pdfPath: string,
     outputDir: string
   ): Promise<{ paths: string[]; page_count: number }>;
+  extractAndEmbed(
+    pdfPath: string,
+    outputDir?: string | null
+  ): Promise<{
+    embeddings: Float32Array[][];
+    num_vectors: number[];
+    page_count: number;
+    paths: string[];
+  }>;
   extractText(
     pdfPath: string
   ): Promise<{